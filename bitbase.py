@@ -0,0 +1,256 @@
+"""Endgame tables for king and pawn, rook or queen against a lone king
+
+The tables are built by retrograde analysis: starting from the mates, every
+position a side can force one from is found by walking moves backwards, so
+each position gets its exact distance to mate. Kings and a pawn go over to
+the queen and rook tables when the pawn promotes, so those are built first.
+
+A table holds one byte per position, indexed by the side to move and the
+squares of the strong king, the weak king and the piece, with the strong
+side turned into white. The byte is 0 for a draw and otherwise one more
+than the plies to mate. Tables are written to files and read back through a
+memory map, so a lookup is an index calculation and one byte read. Build
+them once with:
+
+    python bitbase.py --generate
+"""
+import argparse
+import mmap
+import os
+import sys
+import time
+from position import (WIDTH, HEIGHT, WHITE, BLACK, EMPTY, PAWN, ROOK, QUEEN,
+                      KING, RAYS, KING_STEPS, PAWN_ATTACKS, ROOK_DIRS,
+                      QUEEN_DIRS, piece_color, piece_type)
+
+#Tables in the order they are built, by file name and strong piece
+TABLES = (('kqk', QUEEN), ('krk', ROOK), ('kpk', PAWN))
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'bitbases')
+SQUARES = WIDTH*HEIGHT
+SIZE = 2*SQUARES*SQUARES*SQUARES
+#Side to move as seen from the side with the piece
+STRONG = 0
+WEAK = 1
+
+def index(turn, strong_king, weak_king, piece):
+    """Returns the index of a position in a table"""
+    return ((turn*SQUARES + strong_king)*SQUARES + weak_king)*SQUARES + piece
+
+def _build_lines():
+    """Returns the direction and squares between every two squares on a
+    line, None for squares that are not on one"""
+    lines = [None]*(SQUARES*SQUARES)
+    for start in range(SQUARES):
+        for dir in QUEEN_DIRS:
+            between = ()
+            for target in RAYS[start][dir]:
+                lines[start*SQUARES + target] = (dir, between)
+                between += (target,)
+    return lines
+
+LINES = _build_lines()
+
+def _attacks(type, piece, target, blocker):
+    """Returns true if the strong piece attacks the target square, the
+    strong king on the blocker square may stand in the way"""
+    if type == PAWN:
+        return target in PAWN_ATTACKS[WHITE][piece]
+    line = LINES[piece*SQUARES + target]
+    if line is None or (type == ROOK and line[0] not in ROOK_DIRS):
+        return False
+    return blocker not in line[1]
+
+def _placed(type, strong_king, weak_king, piece):
+    """Returns true if the pieces can stand on the squares together"""
+    if (strong_king == weak_king or strong_king == piece or
+        weak_king == piece or weak_king in KING_STEPS[strong_king]):
+        return False
+    #Pawns never stand on the first or last row
+    return type != PAWN or 0 < piece // WIDTH < HEIGHT - 1
+
+def _weak_moves(type, strong_king, weak_king, piece):
+    """Returns the squares the lone king can move to, taking an unguarded
+    piece included"""
+    moves = []
+    for target in KING_STEPS[weak_king]:
+        if target == strong_king or target in KING_STEPS[strong_king]:
+            continue
+        if target == piece or not _attacks(type, piece, target, strong_king):
+            moves.append(target)
+    return moves
+
+def _strong_sources(type, strong_king, weak_king, piece):
+    """Returns the (strong king, piece) squares the strong side can have
+    moved from to reach the position without promoting"""
+    sources = []
+    for target in KING_STEPS[strong_king]:
+        if (target != weak_king and target != piece and
+            target not in KING_STEPS[weak_king]):
+            sources.append((target, piece))
+    if type == PAWN:
+        #Pawns step back one row, or two from the fourth row
+        behind = piece + WIDTH
+        if behind // WIDTH < HEIGHT - 1 and behind not in (strong_king, weak_king):
+            sources.append((strong_king, behind))
+            if (piece // WIDTH == HEIGHT - 4 and
+                behind + WIDTH not in (strong_king, weak_king)):
+                sources.append((strong_king, behind + WIDTH))
+        return sources
+    for dir in (ROOK_DIRS if type == ROOK else QUEEN_DIRS):
+        for target in RAYS[piece][dir]:
+            if target == strong_king or target == weak_king:
+                break
+            sources.append((strong_king, target))
+    return sources
+
+def generate(type, promotions = None):
+    """Returns the table of the strong piece type as a bytearray, pawns
+    promote into the tables given per piece type"""
+    promotions = promotions or {}
+    values = bytearray(SIZE)
+    #Moves the weak side has left that do not lose
+    counts = bytearray(SIZE)
+    #Positions waiting to be settled at every distance to mate
+    pending = [[] for _ in range(256)]
+    for strong_king in range(SQUARES):
+        for weak_king in range(SQUARES):
+            for piece in range(SQUARES):
+                if not _placed(type, strong_king, weak_king, piece):
+                    continue
+                check = _attacks(type, piece, weak_king, strong_king)
+                moves = _weak_moves(type, strong_king, weak_king, piece)
+                counts[index(WEAK, strong_king, weak_king, piece)] = len(moves)
+                if not moves and check:
+                    pending[0].append(index(WEAK, strong_king, weak_king, piece))
+                #Promotions lead into the other tables
+                if (type == PAWN and not check and piece // WIDTH == 1 and
+                    piece - WIDTH not in (strong_king, weak_king)):
+                    for table in promotions.values():
+                        value = table[index(WEAK, strong_king, weak_king,
+                                            piece - WIDTH)]
+                        if value:
+                            pending[value].append(
+                                index(STRONG, strong_king, weak_king, piece))
+    #Settle positions in order of distance, so the strong side gets the
+    #fastest mate and the weak side the slowest
+    for plies in range(len(pending)):
+        for position in pending[plies]:
+            if values[position]:
+                continue
+            values[position] = plies + 1
+            rest, piece = divmod(position, SQUARES)
+            rest, weak_king = divmod(rest, SQUARES)
+            turn, strong_king = divmod(rest, SQUARES)
+            if turn == WEAK:
+                #Every move into a lost position wins for the strong side
+                for source_king, source in _strong_sources(
+                    type, strong_king, weak_king, piece):
+                    if not _attacks(type, source, weak_king, source_king):
+                        pending[plies + 1].append(
+                            index(STRONG, source_king, weak_king, source))
+            else:
+                #The weak side loses once every move it has loses
+                for source in KING_STEPS[weak_king]:
+                    if (source == strong_king or source == piece or
+                        source in KING_STEPS[strong_king]):
+                        continue
+                    before = index(WEAK, strong_king, source, piece)
+                    counts[before] -= 1
+                    if not counts[before]:
+                        pending[plies + 1].append(before)
+    return values
+
+def generate_all(directory = DIRECTORY):
+    """Builds every table and writes them to the directory"""
+    os.makedirs(directory, exist_ok = True)
+    tables = {}
+    for name, type in TABLES:
+        start = time.perf_counter()
+        tables[type] = generate(type, {QUEEN: tables.get(QUEEN),
+                                       ROOK: tables.get(ROOK)}
+                                if type == PAWN else {})
+        with open(os.path.join(directory, f'{name}.bin'), 'wb') as file:
+            file.write(tables[type])
+        wins = sum(1 for value in tables[type][:SIZE//2] if value)
+        longest = max(tables[type]) - 1
+        print(f'{name}: {wins} wins with the strong side to move, longest '
+              f'mate {longest} plies, {time.perf_counter() - start:.1f}s')
+
+class Bitbases:
+    """The endgame tables found in a directory, read through memory maps"""
+    def __init__(self, directory = DIRECTORY):
+        """Maps the tables that have been generated"""
+        self.files = []
+        self.tables = {}
+        for name, type in TABLES:
+            path = os.path.join(directory, f'{name}.bin')
+            if not os.path.exists(path):
+                continue
+            file = open(path, 'rb')
+            self.files.append(file)
+            self.tables[type] = mmap.mmap(file.fileno(), 0,
+                                          access = mmap.ACCESS_READ)
+
+    def close(self):
+        """Unmaps the tables and closes their files"""
+        for table in self.tables.values():
+            table.close()
+        for file in self.files:
+            file.close()
+        self.tables = {}
+        self.files = []
+
+    def probe_squares(self, color, type, strong_king, weak_king, piece, turn):
+        """Returns the result for the side to move, 1 when it mates, -1 when
+        it gets mated and 0 for a draw, with the plies to mate as a tuple,
+        or None without a table. The color is the side with the piece."""
+        table = self.tables.get(type)
+        if table is None:
+            return None
+        #Tables are seen from white, so black turns the board over
+        if color == BLACK:
+            strong_king ^= SQUARES - WIDTH
+            weak_king ^= SQUARES - WIDTH
+            piece ^= SQUARES - WIDTH
+        if turn == color:
+            value = table[index(STRONG, strong_king, weak_king, piece)]
+            return (1, value - 1) if value else (0, 0)
+        value = table[index(WEAK, strong_king, weak_king, piece)]
+        return (-1, value - 1) if value else (0, 0)
+
+    def probe(self, position):
+        """Returns the result and plies to mate for the side to move of a
+        Position as probe_squares does, or None when it is not one of the
+        endgames"""
+        if position.board.count(EMPTY) != SQUARES - 3:
+            return None
+        piece = -1
+        for sq in range(SQUARES):
+            code = position.board[sq]
+            if code and piece_type(code) != KING:
+                piece = sq
+                break
+        if piece < 0:
+            return None
+        color = piece_color(position.board[piece])
+        return self.probe_squares(color, piece_type(position.board[piece]),
+                                  position.kings[color],
+                                  position.kings[color ^ 1], piece,
+                                  position.turn)
+
+def main(argv = None):
+    """Generates the tables from the command line"""
+    parser = argparse.ArgumentParser(description = 'Endgame tables')
+    parser.add_argument('--generate', action = 'store_true',
+                        help = 'build the tables and write them to disk')
+    parser.add_argument('--directory', default = DIRECTORY)
+    args = parser.parse_args(argv)
+    if args.generate:
+        generate_all(args.directory)
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,16 @@
 import pygame
+import argparse
+import os
 import sys
+from position import (Position, square, coords, piece_color, piece_type,
+                      WHITE, BLACK, EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN,
+                      KING, NAME_TYPES, COLOR_NAMES, CASTLES, START_FEN)
+from engine import Engine, SearchWorker
+from pgn import write_game
+from book import Book
+from bitbase import Bitbases
+from instrument import Stats
+from journal import open_journal
 
 class Piece(pygame.sprite.Sprite):
     """Sprite class to represent all possible chess pieces"""
@@ -12,22 +23,35 @@ class Piece(pygame.sprite.Sprite):
         self.just_moved = False
         self.has_moved_before = has_moved
         self.has_moved = has_moved
-        self.dirs = []
-        self.range = 1
         self.is_clicked = False
+        self.captured = None
 
     def set_side(self, side, sides):
         self.side = side
         self.sides = sides
-        self.image = pygame.image.load(f'images/{side}_{self.type}.png').convert_alpha()
-        self.rect = self.image.get_rect(topleft = coord_to_pixel(*self.pos))
+        self.image_name = f'{side}_{self.type}'
+        self.rect = pygame.Rect(coord_to_pixel(*self.pos),
+                                (SQUARE_SIZE,SQUARE_SIZE))
+
+    @property
+    def image(self):
+        """The image of the piece, loaded the first time it is drawn"""
+        return get_image(self.image_name)
 
     def set_pos(self, new_pos):
         """Sets the position of the piece"""
+        #Keep the occupancy index in step when the piece is on the board
+        if Side.board[self.pos[1]][self.pos[0]] is self:
+            Side.board[self.pos[1]][self.pos[0]] = None
+            Side.board[new_pos[1]][new_pos[0]] = self
+            mark_dirty(self.pos, new_pos)
         self.pos = new_pos
 
     def set_is_clicked(self, new_value):
         """Sets the is clicked attribute of this piece"""
+        if self.is_clicked != new_value:
+            #The highlights of the piece appear or disappear
+            mark_dirty(self.pos, *self.get_move_locs())
         self.is_clicked = new_value
 
     def check_side(self):
@@ -47,94 +71,32 @@ class Piece(pygame.sprite.Sprite):
     def get_pos(self):
         return self.pos
 
-    def get_pressure(self):
-        """Returns the positions that this chess piece puts pressure on"""
-        pressure = []
-        if self.check_side():
-            for dir in self.dirs:
-                dir_range = self.range
-                x = self.pos[0] + dir[0]
-                y = self.pos[1] + dir[1]
-                while (dir_range != 0 and x >= 0 and x < WIDTH and y >= 0 and 
-                       y < HEIGHT):
-                    pressure.append((x,y))
-                    dir_range -= 1
-                    if (collide_point(self.sides[1],x,y) or 
-                        collide_point(self.sides[0],x,y)):
-                        dir_range = 0
-                    x += dir[0]
-                    y += dir[1]
-        else:
-            for dir in self.dirs:
-                dir_range = self.range
-                x = self.pos[0] + dir[0]
-                y = self.pos[1] + dir[1]
-                while (dir_range != 0 and x >= 0 and x < WIDTH and y >= 0 and 
-                       y < HEIGHT):
-                    pressure.append((x,y))
-                    dir_range -= 1
-                    if (collide_point(self.sides[0],x,y) or 
-                        collide_point(self.sides[1],x,y)):
-                        dir_range = 0
-                    x += dir[0]
-                    y += dir[1]
-        return pressure
-
-    def get_possible_move_locs(self):
-        """Returns the possible move locations, ignoring check"""
-        possible_moves = []
-        if self.check_side():
-            for dir in self.dirs:
-                dir_range = self.range
-                x = self.pos[0] + dir[0]
-                y = self.pos[1] + dir[1]
-                while (dir_range != 0 and x >= 0 and x < WIDTH and y >= 0 and 
-                       y < HEIGHT and not collide_point(self.sides[0],x,y)):
-                    possible_moves.append((x,y))
-                    dir_range -= 1
-                    if collide_point(self.sides[1],x,y):
-                        dir_range = 0
-                    x += dir[0]
-                    y += dir[1]
-        else:
-            for dir in self.dirs:
-                dir_range = self.range
-                x = self.pos[0] + dir[0]
-                y = self.pos[1] + dir[1]
-                while (dir_range != 0 and x >= 0 and x < WIDTH and y >= 0 and 
-                       y < HEIGHT and not collide_point(self.sides[1],x,y)):
-                    possible_moves.append((x,y))
-                    dir_range -= 1
-                    if collide_point(self.sides[0],x,y):
-                        dir_range = 0
-                    x += dir[0]
-                    y += dir[1]
-        return possible_moves
+    def get_square(self):
+        """Returns the square index of the piece in the position"""
+        return square(*self.pos)
 
     def get_move_locs(self):
         """Returns locations this piece can move to"""
-        moves = []
-        #Go through all the moves typically afforded to the piece
-        for move in self.get_possible_move_locs():
-            #Save old position and test new position if check results
-            old_pos = self.pos
-            self.pos = move
-            if self.check_side():
-                causes_check = self.sides[0].test_if_check(move = move)
-            else:
-                causes_check = self.sides[1].test_if_check(move = move)
-            #Can move to this space
-            if not causes_check:
-                moves.append(move)
-            #Return to old position
-            self.pos = old_pos
-        return moves
+        if Side.position.turn != self.get_color():
+            return []
+        return Side.get_move_table().get(self.pos, [])
+
+    def get_color(self):
+        """Returns the color of this piece in the position"""
+        return WHITE if self.side == 'white' else BLACK
 
     def show_moves(self):
         """Visualize the locations the chess piece can move to"""
         moves = self.get_move_locs()
         for move in moves:
-            screen.blit(avail_move_surf,coord_to_pixel(*move))
+            screen.blit(get_image('avail_move'),coord_to_pixel(*move))
+
+    def draw_selection(self):
+        """Draws the highlights of this piece if it is clicked"""
+        if self.is_clicked:
+            #Visual continuance
+            screen.blit(get_image('avail_move'),coord_to_pixel(*self.pos))
+            self.show_moves()
 
     def get_just_moved(self):
         """Check if this piece had just moved"""
@@ -143,11 +105,33 @@ class Piece(pygame.sprite.Sprite):
     def get_move_info(self):
         """Get the info for the move this piece just made"""
         self.just_moved = False
-        return (self,self.prev_pos,self.pos,self.has_moved_before)
+        return (self,self.prev_pos,self.pos,self.has_moved_before,self.captured)
 
     def update_rect(self):
         self.rect.topleft = coord_to_pixel(*self.pos)
 
+    def get_captured(self, new_pos):
+        """Returns the enemy pieces taken by moving to a new position"""
+        if self.check_side():
+            return collide_point(self.sides[1],*new_pos)
+        return collide_point(self.sides[0],*new_pos)
+
+    def move_to(self, new_pos):
+        """Moves the piece to a new position and takes what is there"""
+        Side.play_move(self.pos, new_pos)
+        collide = self.get_captured(new_pos)
+        if self.check_side():
+            self.sides[1].remove(collide)
+        else:
+            self.sides[0].remove(collide)
+        self.captured = collide[0] if collide else None
+        self.prev_pos = self.pos
+        self.set_pos(new_pos)
+        self.rect.topleft = coord_to_pixel(*self.pos)
+        self.has_moved_before = self.has_moved
+        self.has_moved = True
+        self.just_moved = True
+
     def update(self, events):
         """Update the chess piece action and visual"""
         if events:
@@ -158,39 +142,16 @@ class Piece(pygame.sprite.Sprite):
                     if self.is_clicked:
                         #Clicking the same piece
                         if self.pos == event_pos:
-                            self.is_clicked = True
+                            self.set_is_clicked(True)
                         #Check for other possibilities and take action
                         else:
-                            self.is_clicked = False
+                            self.set_is_clicked(False)
                             if event_pos in self.get_move_locs():
-                                self.prev_pos = self.pos
-                                self.pos = event_pos
-                                self.rect.topleft = coord_to_pixel(*self.pos)
-                                self.has_moved_before = self.has_moved
-                                self.has_moved = True
-                                self.just_moved = True
-                                if self.check_side():
-                                    collide = pygame.sprite.spritecollide(self, 
-                                                                self.sides[1],False)
-                                    self.sides[1].remove(collide)
-                                    for piece in collide:
-                                        Side.dead_pieces.append((piece,Side.move_count))
-                                else:
-                                    collide = pygame.sprite.spritecollide(self,
-                                                                self.sides[0],
-                                                                False)
-                                    self.sides[0].remove(collide)
-                                    for piece in collide:
-                                        Side.dead_pieces.append((piece,Side.move_count))
+                                self.move_to(event_pos)
                     else:
                         #See if the piece is being clicked for the first time
                         if self.pos == event_pos:
-                            self.is_clicked = True
-
-        if self.is_clicked:
-            #Visual continuance
-            screen.blit(avail_move_surf,coord_to_pixel(*self.pos))
-            self.show_moves()
+                            self.set_is_clicked(True)
 
 class Pawn(Piece):
     """A Pawn chess piece, most common piece from chess"""
@@ -198,197 +159,46 @@ class Pawn(Piece):
         """Initiates the Pawn piece"""
         super().__init__('pawn', pos, has_moved)
 
-    def get_pressure(self):
-        """Returns the diagonal points of applied pressure"""
-        x,y = self.pos
-        if self.check_side():
-            if x == 0:
-                return [(1, y-1)]
-            elif x == 7:
-                return [(6, y-1)]
-            else:
-                return [(x-1,y-1),(x+1,y-1)]
-        else:
-            if x == 0:
-                return [(1, y+1)]
-            elif x == 7:
-                return [(6, y+1)]
+    def get_captured(self, new_pos):
+        """Returns the pieces taken, pawns without a piece to take 
+        diagonally take the pawn behind with en passant"""
+        collide = super().get_captured(new_pos)
+        if not collide and new_pos[0] != self.pos[0]:
+            if self.check_side():
+                collide = collide_point(self.sides[1],new_pos[0],new_pos[1]+1)
             else:
-                return [(x-1,y+1),(x+1,y+1)]
-            
-    def get_possible_move_locs(self):
-        """Sees if there are pieces to take diagonally or space ahead"""
-        pressure = self.get_pressure()
-        possible_moves = []
-        if self.check_side():
-            #Check if there are diagonal points to capture
-            for move in pressure:
-                if collide_point(self.sides[1],*move):
-                    possible_moves.append(move)
-            #Checks if there is a piece ahead of the pawn
-            if (not collide_point(self.sides[1], self.pos[0], self.pos[1]-1) 
-                and not collide_point(self.sides[0], self.pos[0],
-                                      self.pos[1]-1)):
-                
-                possible_moves.append((self.pos[0],self.pos[1]-1))
-                #Checks if the pawn has moved and if there is a piece two 
-                #spaces ahead
-                if (not self.has_moved and not 
-                    collide_point(self.sides[1], self.pos[0], self.pos[1]-2) 
-                    and not collide_point(self.sides[0], self.pos[0],
-                                          self.pos[1]-2)):
-                    
-                    possible_moves.append((self.pos[0],self.pos[1]-2))
-            #Check if pawn can lower en passant
-            if self.sides[0].can_lower_en_passant(self):
-                possible_moves.append((self.pos[0]-1, self.pos[1]-1))
-            #Check if pawn can higher en passant
-            if self.sides[0].can_higher_en_passant(self):
-                possible_moves.append((self.pos[0]+1, self.pos[1]-1))
-        else:
-            #Checks if there are diagonal points to capture
-            for move in pressure:
-                if collide_point(self.sides[0],*move):
-                    possible_moves.append(move)
-            #Checks if there is a piece ahead of the pawn
-            if (not collide_point(self.sides[1], self.pos[0], self.pos[1]+1) 
-                and not collide_point(self.sides[0], self.pos[0],
-                                      self.pos[1]+1)):
-                
-                possible_moves.append((self.pos[0],self.pos[1]+1))
-                #Checks if the pawn has moved and if there is a piece two 
-                #spaces ahead
-                if (not self.has_moved and not 
-                    collide_point(self.sides[1], self.pos[0], self.pos[1]+2) 
-                    and not collide_point(self.sides[0], self.pos[0],
-                                          self.pos[1]+2)):
-                    possible_moves.append((self.pos[0],self.pos[1]+2))
-                #Check if pawn can lower en passant
-                if self.sides[1].can_lower_en_passant(self):
-                    possible_moves.append((self.pos[0]-1, self.pos[1]+1))
-                #Check if pawn can higher en passant
-                if self.sides[1].can_higher_en_passant(self):
-                    possible_moves.append((self.pos[0]+1, self.pos[1]+1))
-        return possible_moves
-
-    def update(self, events):
-        """Update the pawn action and visual"""
-        if events:
-            for event in events:
-                if event.type == pygame.MOUSEBUTTONUP:
-                    event_pos = pixel_to_coord(*event.pos)
-                    #This piece is already clicked
-                    if self.is_clicked:
-                        #Clicking the same piece
-                        if self.pos == event_pos:
-                            self.is_clicked = True
-                        #Check for other possibilities and take action
-                        else:
-                            self.is_clicked = False
-                            if event_pos in self.get_move_locs():
-                                self.prev_pos = self.pos
-                                self.pos = event_pos
-                                self.rect.topleft = coord_to_pixel(*self.pos)
-                                self.has_moved_before = self.has_moved
-                                self.has_moved = True
-                                self.just_moved = True
-                                if self.check_side():
-                                    collide = pygame.sprite.spritecollide(self, 
-                                                                self.sides[1], 
-                                                                False)
-                                    if not collide:
-                                        for pawn in [piece for piece in
-                                                self.sides[1] if 
-                                                piece.get_pos() == 
-                                                (self.pos[0],self.pos[1]+1)]:
-                                            self.sides[1].remove(pawn)
-                                            Side.dead_pieces.append((pawn,Side.move_count))
-                                    else:
-                                        self.sides[1].remove(collide)
-                                        for piece in collide:
-                                            Side.dead_pieces.append((piece,Side.move_count))
-                                else:
-                                    collide = pygame.sprite.spritecollide(self,
-                                                                self.sides[0],
-                                                                False)
-                                    if not collide:
-                                        for pawn in [piece for piece in
-                                                self.sides[0] if 
-                                                piece.get_pos() == 
-                                                (self.pos[0],self.pos[1]-1)]:
-                                            self.sides[0].remove(pawn)
-                                            Side.dead_pieces.append((pawn,Side.move_count))
-                                    else:
-                                        self.sides[0].remove(collide)
-                                        for piece in collide:
-                                            Side.dead_pieces.append((piece,Side.move_count))
-                    else:
-                        #See if the piece is being clicked for the first time
-                        if self.pos == event_pos:
-                            self.is_clicked = True
-
-        if self.is_clicked:
-            #Visual continuance
-            screen.blit(avail_move_surf,coord_to_pixel(*self.pos))
-            self.show_moves()
+                collide = collide_point(self.sides[0],new_pos[0],new_pos[1]-1)
+        return collide
 
 class Knight(Piece):
     """A knight chess piece, moves in Ls"""
     def __init__(self, pos, has_moved = False):
         """Initializes the knight piece"""
         super().__init__('knight',pos,has_moved)
-        #Set up the knight moves
-        self.dirs = [(2,1),(2,-1),(-2,1),(-2,-1),(1,2),(1,-2),(-1,2),(-1,-2)]
 
 class Bishop(Piece):
     """A bishop chess piece, moves in diagonals"""
     def __init__(self, pos, has_moved = False):
         """Initializes the bishop piece"""
         super().__init__('bishop',pos,has_moved)
-        #Set up the bishop moves
-        self.dirs = [(1,1),(-1,-1),(1,-1),(-1,1)]
-        self.range = -1
 
 class Rook(Piece):
     """A rook chess piece, moves in horizontals"""
     def __init__(self, pos, has_moved = False):
         """Initializes the rook piece"""
         super().__init__('rook',pos,has_moved)
-        #Set up the rook moves
-        self.dirs = [(1,0),(-1,0),(0,1),(0,-1)]
-        self.range = -1
 
 class Queen(Piece):
     """A queen chess piece, moves in all directions, most powerful piece"""
     def __init__(self, pos, has_moved = False):
         """Initializes the queen piece"""
         super().__init__('queen',pos,has_moved)
-        #Set up the queen moves
-        self.dirs = [(1,1),(-1,-1),(1,-1),(-1,1),(1,0),(-1,0),(0,1),(0,-1)]
-        self.range = -1
 
 class King(Piece):
     """A king chess piece, the most important of all pieces"""
     def __init__(self, pos, has_moved = False):
         """Initializes the king piece"""
         super().__init__('king',pos,has_moved)
-        #Set up the king moves
-        self.dirs = [(1,1),(-1,-1),(1,-1),(-1,1),(1,0),(-1,0),(0,1),(0,-1)]
-    
-    def get_move_locs(self):
-        """Get all the moves for the king"""
-        moves = super().get_move_locs()
-        if self.check_side():
-            if self.sides[0].can_short_castle():
-                moves.append((self.pos[0]+2,self.pos[1]))
-            if self.sides[0].can_long_castle():
-                moves.append((self.pos[0]-2,self.pos[1]))
-        else:
-            if self.sides[1].can_short_castle():
-                moves.append((self.pos[0]+2,self.pos[1]))
-            if self.sides[1].can_long_castle():
-                moves.append((self.pos[0]-2,self.pos[1]))
-        return moves
 
 class Side(pygame.sprite.Group):
     """Group class to hold a player's pieces"""
@@ -396,10 +206,16 @@ class Side(pygame.sprite.Group):
     #Collection of sides
     sides = []
     move_made = False
-    dead_pieces = []
-    created_pieces = []
+    #Undo record of every ply: (piece, prev_pos, pos, has_moved_before,
+    #captured, castle, promoted) where castle is (rook, rook_prev_pos)
     moves = []
     move_count = 0
+    position = Position()
+    #Occupancy index of the pieces on the board, indexed [y][x]
+    board = [[None]*8 for _ in range(8)]
+    #Legal moves of the position, built once after every change to it
+    legal_moves = []
+    move_table = None
 
     def __init__(self, side, *sprites: Piece):
         """Initializes group variables to track game"""
@@ -418,103 +234,23 @@ class Side(pygame.sprite.Group):
         super().add(*sprites)
         for sprite in sprites:
             sprite.set_side(self.side,self.sides)
-
-    def can_short_castle(self):
-        """Check if short castling is a possible move, true if so"""
-        #Get king position
-        x,y = self.king.get_pos()
-        #Make sure the king is not in check and has not moved
-        if not self.king.get_has_moved() and not self.test_if_check():
-            #Make sure the spaces next to king is empty
-            if (not ([piece for piece in self if piece.get_pos() == (x+1, y)] 
-                or [piece for piece in self if piece.get_pos() == (x+2,y)])):
-                #Make sure the rook is there and has not moved
-                if [piece for piece in self if piece.get_pos() == (x+3, y) and piece.get_type() == 'rook' and not piece.get_has_moved()]:
-                    #Make sure one space will not put king in check
-                    self.king.set_pos((x+1,y))
-                    if not self.test_if_check():
-                        #Make sure final space will not put king in check
-                        self.king.set_pos((x+2,y))
-                        if not self.test_if_check():
-                            #Return king to space
-                            self.king.set_pos((x,y))
-                            return True
-        #Return king to space
-        self.king.set_pos((x,y))
-        return False
-    
-    def can_long_castle(self):
-        """Check if long castling is a possible move, true if so"""
-        #Get king position
-        x,y = self.king.get_pos()
-        #Make sure the king is not in check and has not moved
-        if not self.king.get_has_moved() and not self.test_if_check():
-            #Make sure the spaces next to king is empty
-            if (not ([piece for piece in self if piece.get_pos() == (x-1, y)] 
-                or [piece for piece in self if piece.get_pos() == (x-2,y)]
-                or [piece for piece in self if piece.get_pos() == (x-3,y)])):
-                #Make sure the rook is there and has not moved
-                if [piece for piece in self if piece.get_pos() == (x-4, y) and piece.get_type() == 'rook' and not piece.get_has_moved()]:
-                    #Make sure one space will not put king in check
-                    self.king.set_pos((x-1,y))
-                    if not self.test_if_check():
-                        #Make sure final space will not put king in check
-                        self.king.set_pos((x-2,y))
-                        if not self.test_if_check():
-                            #Return king to space
-                            self.king.set_pos((x,y))
-                            return True
-        #Return king to space
-        self.king.set_pos((x,y))
-        return False
-
-    def can_lower_en_passant(self, pawn):
-        """Check if pawn can en passant into a lower x position"""
-        #Get pawn position
-        x,y = pawn.get_pos()
-        #Check which side is being dealt with
-        if self.check_side():
-            #Check if pawn is at right y position and there is a lower position
-            if y == 3 and x != 0:
-                #Check if a pawn just moved double space
-                other_move = self.sides[1].get_last_move()
-                if (other_move[0].get_type() == 'pawn' and 
-                    other_move[1][1] == 1 and other_move[2] == (x-1, y)):
-                    return True
-        else:
-            #Check if pawn is at right y position and there is a lower position
-            if y == 4 and x != 0:
-                #Check if a pawn just moved double space
-                other_move = self.sides[0].get_last_move()
-                if (other_move[0].get_type() == 'pawn' and 
-                    other_move[1][1] == 6 and other_move[2] == (x-1, y)):
-                    return True
-        #Can't lower en passant
-        return False
-    
-    def can_higher_en_passant(self, pawn):
-        """Check if pawn can en passant into a higher x position"""
-        #Get pawn position
-        x,y = pawn.get_pos()
-        #Check which side is being dealt with
-        if self.check_side():
-            #Check if pawn is at right y position and there is a higher position
-            if y == 3 and x != 7:
-                #Check if a pawn just moved double space
-                other_move = self.sides[1].get_last_move()
-                if (other_move[0].get_type() == 'pawn' and 
-                    other_move[1][1] == 1 and other_move[2] == (x+1, y)):
-                    return True
-        else:
-            #Check if pawn is at right y position and there is a higher position
-            if y == 4 and x != 7:
-                #Check if a pawn just moved double space
-                other_move = self.sides[0].get_last_move()
-                if (other_move[0].get_type() == 'pawn' and 
-                    other_move[1][1] == 6 and other_move[2] == (x+1, y)):
-                    return True
-        #Can't higher en passant
-        return False
+            Side.board[sprite.pos[1]][sprite.pos[0]] = sprite
+            mark_dirty(sprite.pos)
+
+    def restore(self, piece):
+        """Puts a piece taken off the board back, it keeps its image"""
+        super().add(piece)
+        Side.board[piece.pos[1]][piece.pos[0]] = piece
+        mark_dirty(piece.pos)
+
+    def remove_internal(self, sprite):
+        """Removes a piece from the side and from the occupancy index, used
+        by both remove and kill"""
+        super().remove_internal(sprite)
+        x,y = sprite.get_pos()
+        if Side.board[y][x] is sprite:
+            Side.board[y][x] = None
+        mark_dirty((x,y))
 
     def get_side(self):
         """Returns the side of this team"""
@@ -530,103 +266,135 @@ class Side(pygame.sprite.Group):
 
     def get_promote_image(self):
         """Gives the image for the promotion of this side"""
-        return pygame.image.load(f'images/{self.side}_promotion.png').convert()
+        return get_image(f'{self.side}_promotion', alpha = False)
 
     def get_info(self):
         """Retrieve important info from pieces to see what is 
         available"""
-        #Track total moves possible
-        pos_moves = 0
         #Go through every piece to get info  
         for piece in self:
-            pos_moves += len(piece.get_move_locs())
             #Piece just moved, get the move spaces
             if piece.get_just_moved():
-                self.last_move = piece.get_move_info()
+                move_info = piece.get_move_info()
+                start, end = move_info[1:3]
+                #Check for castling, the rook goes to the other side of the king
+                castle = None
+                if piece.get_type() == 'king' and abs(end[0] - start[0]) == 2:
+                    rook_x, new_x = (7,5) if end[0] > start[0] else (0,3)
+                    mov_rook = collide_point(self,rook_x,start[1])
+                    mov_rook[0].set_pos((new_x,start[1]))
+                    mov_rook[0].set_has_moved(True)
+                    castle = (mov_rook[0],(rook_x,start[1]))
+                self.last_move = move_info + (castle,None)
                 Side.moves.append(self.last_move)
                 Side.move_count += 1
                 Side.move_made = True
-                #Check for promotion
-                if piece.get_type() == 'pawn' and (piece.get_pos()[1] == 0 or 
-                                             piece.get_pos()[1] == 7):
+                #Check for promotion, the pawn leaves until it is replaced
+                if piece.get_type() == 'pawn' and (end[1] == 0 or end[1] == 7):
+                    self.remove(piece)
                     if self.check_side():
-                        self.sides[0].remove(piece)
-                        Side.dead_pieces.append((piece,Side.move_count-1))
                         return FIRST_PROMOTION
-                    else:
-                        self.sides[1].remove(piece)
-                        Side.dead_pieces.append((piece,Side.move_count-1))
-                        return SECOND_PROMOTION
-                #Check for short castling
-                if (piece.get_type() == 'king' and 
-                    self.last_move[2][0] - self.last_move[1][0] == 2):
-                    if self.check_side():
-                        mov_rook = [rook for rook in self 
-                                    if rook.get_pos() == (7,7)]
-                        mov_rook[0].set_pos((5,7))
-                        mov_rook[0].set_has_moved(True)
-                    else:
-                        mov_rook = [rook for rook in self 
-                                    if rook.get_pos() == (7,0)]
-                        mov_rook[0].set_pos((5,0))
-                        mov_rook[0].set_has_moved(True)
-                #Check for long castling
-                if (piece.get_type() == 'king' and 
-                    self.last_move[2][0] - self.last_move[1][0] == -2):
-                    if self.check_side():
-                        mov_rook = [rook for rook in self 
-                                    if rook.get_pos() == (0,7)]
-                        mov_rook[0].set_pos((3,7))
-                        mov_rook[0].set_has_moved(True)
-                    else:
-                        mov_rook = [rook for rook in self 
-                                    if rook.get_pos() == (0,0)]
-                        mov_rook[0].set_pos((3,0))
-                        mov_rook[0].set_has_moved(True)
+                    return SECOND_PROMOTION
 
-
-        #Check for checkmate and stalemate
-        if pos_moves == 0:
+        #Check for checkmate and stalemate when this side is to move
+        if (Side.position.turn == self.get_color() and 
+            not Side.get_move_table()):
             if self.test_if_check():
                 return CHECKMATE
             else:
                 return STALEMATE
+        #The third time a position is reached the game is drawn
+        if (Side.position.turn == self.get_color() and 
+            Side.position.is_repetition()):
+            return REPETITION
         return ACTIVE_GAME
 
+    def draw_selection(self):
+        """Draws the highlights of the clicked piece of this side"""
+        for piece in self:
+            piece.draw_selection()
+
     def draw_check(self):
         """Draws check if in check"""
         if self.test_if_check():
-            screen.blit(check_surf,coord_to_pixel(*self.king.get_pos()))
+            screen.blit(get_image('check'),coord_to_pixel(*self.king.get_pos()))
 
     def draw_last_move(self):
         """Draws the last move of this side"""
         if self.last_move:
-            screen.blit(last_move_surf,coord_to_pixel(*self.last_move[1]))
-            screen.blit(last_move_surf,coord_to_pixel(*self.last_move[2]))
+            screen.blit(get_image('last_move'),coord_to_pixel(*self.last_move[1]))
+            screen.blit(get_image('last_move'),coord_to_pixel(*self.last_move[2]))
 
     def check_side(self):
         return self.side == self.sides[0].get_side()
 
-    def test_if_check(self, move = None):
+    def get_color(self):
+        """Returns the color of this side in the position"""
+        return WHITE if self.side == 'white' else BLACK
+
+    def test_if_check(self):
         """Returns true if this side is in check, false otherwise"""
-        #Finds if any black piece pressures the white king
-        if self.check_side():
-            for piece in self.sides[1]:
-                #Piece is hypothetically captured
-                if piece.get_pos() == move:
-                    continue
-                #Check if this piece is putting the king in check
-                if self.king.get_pos() in piece.get_pressure():
-                    return True
-        #Finds if any white piece pressures the black king
-        else:
-            for piece in self.sides[0]:
-                #Piece is hypothetically captured
-                if piece.get_pos() == move:
-                    continue
-                if self.king.get_pos() in piece.get_pressure():
-                    return True
-        return False
+        return Side.position.is_check(self.get_color())
+
+    @staticmethod
+    def get_move_table():
+        """Returns the coordinates each piece of the side to move can move
+        to, building them only once per position"""
+        if Side.move_table is None:
+            Side.build_move_table()
+        return Side.move_table
+
+    @staticmethod
+    def build_move_table():
+        """Generates the legal moves of the position and the coordinates
+        each piece can move to"""
+        Side.legal_moves = Side.position.generate_legal_moves()
+        Side.move_table = {}
+        for start, end, _ in Side.legal_moves:
+            ends = Side.move_table.setdefault(coords(start), [])
+            if coords(end) not in ends:
+                ends.append(coords(end))
+
+    @staticmethod
+    def clear_move_table():
+        """Forgets the legal moves once the position has changed"""
+        Side.legal_moves = []
+        Side.move_table = None
+
+    @staticmethod
+    def find_move(start, end, promotion = EMPTY):
+        """Returns the legal move between two coordinates"""
+        Side.get_move_table()
+        move = (square(*start), square(*end), promotion)
+        if move in Side.legal_moves:
+            return move
+        return None
+
+    @staticmethod
+    def play_move(start, end):
+        """Plays a move between two coordinates in the position, promotions
+        are played once the new piece has been chosen"""
+        if not Side.position.is_promotion(start, end):
+            move = Side.find_move(start, end)
+            Side.position.make_move(move)
+            Side.clear_move_table()
+            if journal is not None:
+                journal.write_move(move)
+
+    @staticmethod
+    def promote(side, piece):
+        """Adds the piece a pawn of the side promoted into and plays the
+        promotion in the position"""
+        side.add(piece)
+        #Remember the new piece so undo can take it off again
+        Side.moves[-1] = Side.moves[-1][:6] + (piece,)
+        side.set_last_move(Side.moves[-1])
+        start, end = side.get_last_move()[1:3]
+        move = Side.find_move(start, end, NAME_TYPES[piece.get_type()])
+        Side.position.make_move(move)
+        Side.clear_move_table()
+        if journal is not None:
+            journal.write_move(move)
 
     @staticmethod
     def undo_move():
@@ -636,69 +404,48 @@ class Side(pygame.sprite.Group):
             for side in Side.sides:
                 for piece in side:
                     piece.set_is_clicked(False)
-            #Get the move info that needs to be reversed and new number of moves
-            undid_move = Side.moves.pop()
+            #Take the move back in the position
+            Side.position.unmake_move()
+            Side.clear_move_table()
+            if journal is not None:
+                journal.write_undo()
+            #Get the record of the move that needs to be reversed
+            (piece, prev_pos, pos, has_moved_before,
+             captured, castle, promoted) = Side.moves.pop()
             Side.move_count -= 1
+            if piece.check_side():
+                side, other = Side.sides
+            else:
+                other, side = Side.sides
+            #A promoted piece is replaced by the pawn it came from
+            if promoted:
+                promoted.kill()
+                side.restore(piece)
             #Move the piece back to its old spot and set the has moved attribute
-            undid_move[0].set_pos(undid_move[1])
-            undid_move[0].set_has_moved(undid_move[3])
-            #Check if rook needs to be moved back due to short castling
-            if (undid_move[0].get_type() == 'king' and 
-                undid_move[2][0] - undid_move[1][0] == 2):
-                if undid_move[0].check_side():
-                    mov_rook = [rook for rook in Side.sides[0] 
-                                if rook.get_pos() == (5,7)]
-                    mov_rook[0].set_pos((7,7))
-                    mov_rook[0].set_has_moved(False)
-                else:
-                    mov_rook = [rook for rook in Side.sides[1] 
-                                if rook.get_pos() == (5,0)]
-                    mov_rook[0].set_pos((7,0))
-                    mov_rook[0].set_has_moved(False)
-            #Check if rook needs to be moved back due to long castling
-            if (undid_move[0].get_type() == 'king' and 
-                undid_move[2][0] - undid_move[1][0] == -2):
-                    if undid_move[0].check_side():
-                        mov_rook = [rook for rook in Side.sides[0] 
-                                    if rook.get_pos() == (3,7)]
-                        mov_rook[0].set_pos((0,7))
-                        mov_rook[0].set_has_moved(False)
-                    else:
-                        mov_rook = [rook for rook in Side.sides[1] 
-                                    if rook.get_pos() == (3,0)]
-                        mov_rook[0].set_pos((0,0))
-                        mov_rook[0].set_has_moved(False)
+            piece.set_pos(prev_pos)
+            piece.set_has_moved(has_moved_before)
+            #Move the rook back after castling
+            if castle:
+                castle[0].set_pos(castle[1])
+                castle[0].set_has_moved(False)
             #Correct the last move info
-            if undid_move[0].check_side():
-                if Side.move_count >= 2:
-                    Side.sides[0].set_last_move(Side.moves[-2])
-                else:
-                    Side.sides[0].set_last_move(())
+            if Side.move_count >= 2:
+                side.set_last_move(Side.moves[-2])
             else:
-                if Side.move_count >= 2:
-                    Side.sides[1].set_last_move(Side.moves[-2])
-                else:
-                    Side.sides[1].set_last_move(())
-            #Restore any captured pieces
-            to_restore = [piece for piece in Side.dead_pieces if piece[1] == Side.move_count]
-            for piece in to_restore:
-                Side.dead_pieces.remove(piece)
-                if piece[0].check_side():
-                    Side.sides[0].add(piece[0])
-                else:
-                    Side.sides[1].add(piece[0])
-            #Remove any promoted pieces that are no longer present
-            to_remove = [piece for piece in Side.created_pieces if piece[1] == Side.move_count]
-            for piece in to_remove:
-                Side.created_pieces.remove(piece)
-                if piece[0].check_side():
-                    Side.sides[0].remove(piece[0])
-                else:
-                    Side.sides[1].remove(piece[0])
-                piece[0].kill()
+                side.set_last_move(())
+            #Restore any captured piece
+            if captured:
+                other.restore(captured)
             #Toggle the move
             toggle_turn()
 
+#Piece classes a pawn can promote into
+PROMOTION_CLASSES = {QUEEN: Queen, ROOK: Rook, BISHOP: Bishop, KNIGHT: Knight}
+PIECE_CLASSES = {PAWN: Pawn, KING: King, **PROMOTION_CLASSES}
+
+#Images shared by all sprites, keyed by file name
+images = {}
+
 #Constants
 SQUARE_SIZE = 80
 HEIGHT = 8
@@ -708,10 +455,29 @@ FIRST_PROMOTION = 1
 SECOND_PROMOTION = -1
 CHECKMATE = 2
 STALEMATE = 3
+REPETITION = 4
 FIRST_TURN = 1
 SECOND_TURN = 0
 FIRST_PERSPECTIVE = FIRST_TURN
 SECOND_PERSPECTIVE = SECOND_TURN
+#Seconds the computer may think about a move
+AI_MOVETIME = 1.0
+#Opening book used for hints and by the computer when the file is there
+BOOK_PATH = 'book.bin'
+#Journal the game is written to and restored from, and the directory the
+#finished games are moved to when the game starts
+JOURNAL_PATH = 'game.journal'
+JOURNAL_ARCHIVE = 'journals'
+#Size of the performance overlay in the top left corner and its text
+STATS_SIZE = (250,200)
+STATS_LINE = 18
+STATS_COLOR = (255,255,255)
+STATS_BACKGROUND = (0,0,0,170)
+#Evaluation bar along the left edge and the centipawns that fill it
+EVAL_BAR_WIDTH = 10
+EVAL_BAR_RANGE = 1000
+EVAL_WHITE = (235,235,235)
+EVAL_BLACK = (40,40,40)
 
 def coord_to_pixel(x,y):
     """Returns the pixel location of a provided coordinate"""
@@ -733,9 +499,33 @@ def pixel_to_coord(x,y):
     y = (int)(y/SQUARE_SIZE)
     return (abs(x-(WIDTH-1)),abs(y-(HEIGHT-1)))
 
+def get_image(name, alpha = True):
+    """Returns the image with the name, it is loaded from disk only the first
+    time and then shared by every sprite that uses it"""
+    if name not in images:
+        image = pygame.image.load(f'images/{name}.png')
+        images[name] = image.convert_alpha() if alpha else image.convert()
+    return images[name]
+
+def preload_images():
+    """Loads every piece, promotion and overlay image ahead of use"""
+    for side in ('white', 'black'):
+        for type in NAME_TYPES:
+            get_image(f'{side}_{type}')
+        get_image(f'{side}_promotion', alpha = False)
+    for name in ('avail_move', 'last_move', 'check'):
+        get_image(name)
+    for name in ('chess_board', 'checkmate_screen', 'draw_screen'):
+        get_image(name, alpha = False)
+
 def collide_point(group,x,y):
     """Returns a list of all pieces that collide with a coordinate"""
-    return [piece for piece in group if piece.get_pos() == (x,y)]
+    if x < 0 or x >= WIDTH or y < 0 or y >= HEIGHT:
+        return []
+    piece = Side.board[y][x]
+    if piece is not None and group.has(piece):
+        return [piece]
+    return []
 
 def toggle_turn():
     """Toggles the turn of the game"""
@@ -751,287 +541,652 @@ def toggle_turn():
     for side in Side.sides:
         for piece in side:
             piece.update_rect()
+    #Highlights move to the other side and the board may have flipped
+    mark_overlays()
+    if flip_screen:
+        mark_all_dirty()
+    announce_result()
+
+def announce_result():
+    """Shows the forced result of an endgame in the bitbases in the window
+    title"""
+    caption = 'Chess'
+    pieces = [piece for side in Side.sides for piece in side
+              if piece.get_type() != 'king']
+    if len(pieces) == 1 and sum(len(side) for side in Side.sides) == 3:
+        piece = pieces[0]
+        color = piece.get_color()
+        result = bitbases.probe_squares(
+            color, NAME_TYPES[piece.get_type()],
+            Side.sides[color].king.get_square(),
+            Side.sides[color ^ 1].king.get_square(),
+            piece.get_square(), Side.position.turn)
+        if result is not None and result[0] and result[1]:
+            winner = Side.position.turn
+            if result[0] < 0:
+                winner ^= 1
+            caption = (f'Chess - {COLOR_NAMES[winner]} mates in '
+                       f'{(result[1] + 1) // 2}')
+        elif result is not None and not result[0]:
+            caption = 'Chess - draw'
+    pygame.display.set_caption(caption)
+
+def play_computer_move():
+    """Plays a book move for the computer, or starts the search for its move
+    and plays it once found"""
+    global search, ai_promotion
+    move = None
+    if search is None:
+        if book is not None:
+            move = book.choose(Side.position)
+        if move is None:
+            search = SearchWorker(engine, Side.position, movetime = AI_MOVETIME)
+    elif search.is_done():
+        move = search.get_move()
+        search = None
+    if move is not None:
+        start, end, promotion = move
+        x,y = coords(start)
+        Side.board[y][x].move_to(coords(end))
+        ai_promotion = promotion
+
+def promote_computer_pawn(side):
+    """Promotes the pawn the computer just moved to its chosen piece"""
+    global ai_promotion
+    piece = PROMOTION_CLASSES[ai_promotion](side.get_last_move()[2],
+                                            has_moved=True)
+    Side.promote(side,piece)
+    ai_promotion = EMPTY
+
+def cancel_search():
+    """Aborts the computer's search when its position is taken back"""
+    global search
+    if search is not None:
+        search.cancel()
+        search = None
+
+def fen_has_moved(position, sq):
+    """Returns if the piece on a square of a position read from FEN has
+    moved, kings and rooks keep their castling rights and pawns on their
+    starting row can still step twice"""
+    color = piece_color(position.board[sq])
+    type = piece_type(position.board[sq])
+    if type == PAWN:
+        return coords(sq)[1] != (6 if color == WHITE else 1)
+    if type == KING:
+        return not any(position.castling & castle[0]
+                       for castle in CASTLES[color])
+    if type == ROOK:
+        return not any(position.castling & castle[0] and castle[3] == sq
+                       for castle in CASTLES[color])
+    return False
+
+def load_fen(fen):
+    """Starts a new game from the position described by a FEN string"""
+    global game_state, turn, perspective, show_end_screen, game_fen
+    global first_pieces, second_pieces
+    position = Position(fen)
+    cancel_search()
+    game_fen = fen
+    if journal is not None:
+        journal.write_reset(position)
+    #Reset game state trackers
+    game_state = ACTIVE_GAME
+    turn = FIRST_TURN if position.turn == WHITE else SECOND_TURN
+    if flip_screen:
+        if turn == FIRST_TURN:
+            perspective = FIRST_PERSPECTIVE
+        else:
+            perspective = SECOND_PERSPECTIVE
+    show_end_screen = True
+    #Reset sides and pieces
+    Side.sides = []
+    Side.move_made = False
+    Side.moves = []
+    Side.move_count = 0
+    Side.position = position
+    Side.clear_move_table()
+    mark_all_dirty()
+    Side.board = [[None]*WIDTH for _ in range(HEIGHT)]
+    update_book_hint()
+    pieces = ([], [])
+    for sq, piece in enumerate(position.board):
+        if piece != EMPTY:
+            pieces[piece_color(piece)].append(PIECE_CLASSES[piece_type(piece)](
+                coords(sq), fen_has_moved(position, sq)))
+    first_pieces = Side('white', *pieces[WHITE])
+    second_pieces = Side('black', *pieces[BLACK])
+    #The pawn that just stepped twice is the last move of its side
+    if position.ep >= 0:
+        step = WIDTH if position.turn == BLACK else -WIDTH
+        end = coords(position.ep - step)
+        pawn = collide_point(Side.sides[1-position.turn],*end)[0]
+        Side.sides[1-position.turn].set_last_move(
+            (pawn,coords(position.ep + step),end,False,None,None,None))
+    announce_result()
+
+def replay_moves(moves):
+    """Plays moves through the pieces as if they had been clicked, used to
+    restore a game from the journal, stops at the first illegal move"""
+    for move in moves:
+        if not Side.position.is_legal(move):
+            break
+        start, end, promotion = move
+        side = Side.sides[Side.position.turn]
+        x,y = coords(start)
+        Side.board[y][x].move_to(coords(end))
+        if side.get_info() in (FIRST_PROMOTION, SECOND_PROMOTION):
+            Side.promote(side, PROMOTION_CLASSES[promotion](coords(end),
+                                                            has_moved=True))
+        toggle_turn()
+        Side.move_made = False
 
-#Screen and clock set up
-pygame.init()
-screen = pygame.display.set_mode((WIDTH*SQUARE_SIZE,HEIGHT*SQUARE_SIZE))
-pygame.display.set_caption("Chess")
-clock = pygame.time.Clock()
-
-#Organization
-game_state = ACTIVE_GAME
-turn = FIRST_TURN
-show_end_screen = True
-flip_screen = False
-perspective = FIRST_PERSPECTIVE
-
-#Background
-board_background = pygame.image.load('images/chess_board.png').convert()
-
-avail_move_surf = pygame.image.load('images/avail_move.png').convert_alpha()
-
-last_move_surf = pygame.image.load('images/last_move.png').convert_alpha()
-
-check_surf = pygame.image.load('images/check.png').convert_alpha()
-
-checkmate_surf = pygame.image.load('images/checkmate_screen.png').convert()
-
-draw_surf = pygame.image.load('images/draw_screen.png').convert()
-
-#White pieces set up
-first_pieces = Side('white', Rook((0,7)),Knight((1,7)),
-                    Bishop((2,7)),Queen((3,7)),
-                    King((4,7)),Rook((7,7)),
-                    Knight((6,7)),Bishop((5,7)))
-for x in range(8):
-    first_pieces.add(Pawn((x,6)))
-
-first_promote_surf = first_pieces.get_promote_image()
-
-#Black pieces set up
-second_pieces = Side('black', Rook((0,0)),Knight((1,0)),
-                    Bishop((2,0)),Queen((3,0)),
-                    King((4,0)),Rook((7,0)),
-                    Knight((6,0)),Bishop((5,0)))
-for x in range(8):
-    second_pieces.add(Pawn((x,1)))
+def save_fen():
+    """Returns the FEN string of the game"""
+    return Side.position.fen()
 
-second_promote_surf = second_pieces.get_promote_image()
+def save_pgn():
+    """Returns the PGN of the moves played since the game started"""
+    moves = []
+    for record in Side.moves:
+        promoted = record[6]
+        moves.append((square(*record[1]),square(*record[2]),
+                      NAME_TYPES[promoted.get_type()] if promoted else EMPTY))
+    if game_state == CHECKMATE:
+        result = '0-1' if Side.position.turn == WHITE else '1-0'
+    elif game_state == STALEMATE or game_state == REPETITION:
+        result = '1/2-1/2'
+    else:
+        result = '*'
+    return write_game(moves, game_fen, result = result)
 
-#Game loop
-while True:
-    #Event loop
-    events = pygame.event.get()
-    for event in events:
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-        if game_state == ACTIVE_GAME:
-            if event.type == pygame.KEYUP:
-                #Reset game
-                if event.key == pygame.K_r:
-                    #Reset game state trackers
-                    game_state = ACTIVE_GAME
-                    turn = FIRST_TURN
-                    show_end_screen = True
-                    #Reset sides and pieces
-                    Side.sides = []
-                    Side.move_made = False
-                    Side.moves = []
-                    Side.move_count = 0
-                    Side.dead_pieces = []
-                    Side.created_pieces = []
-
-                    #White pieces set up
-                    first_pieces = Side('white', Rook((0,7)),Knight((1,7)),
-                                        Bishop((2,7)),Queen((3,7)),
-                                        King((4,7)),Rook((7,7)),
-                                        Knight((6,7)),Bishop((5,7)))
-                    for x in range(8):
-                        first_pieces.add(Pawn((x,6)))
-                    #Black pieces set up
-                    second_pieces = Side('black', Rook((0,0)),Knight((1,0)),
-                                        Bishop((2,0)),Queen((3,0)),
-                                        King((4,0)),Rook((7,0)),
-                                        Knight((6,0)),Bishop((5,0)))
-                    for x in range(8):
-                        second_pieces.add(Pawn((x,1)))
-                #Undo move
-                elif event.key == pygame.K_u:
-                    Side.undo_move()
-                #Lock or release screen flipping
-                elif event.key == pygame.K_f:
-                    flip_screen = not flip_screen
-                    if flip_screen:
-                        if turn == FIRST_TURN:
-                            perspective = FIRST_PERSPECTIVE
-                        else:
-                            perspective = SECOND_PERSPECTIVE
-                        for side in Side.sides:
-                            for piece in side:
-                                piece.update_rect()
-        elif game_state == FIRST_PROMOTION:
-            if event.type == pygame.MOUSEBUTTONUP:
-                coord = pixel_to_coord(*event.pos)
-                if perspective == FIRST_PERSPECTIVE:
-                    promote_coord = first_pieces.get_last_move()[2]
-                    if coord[0] == promote_coord[0]:
-                        if coord[1] == promote_coord[1]:
-                            piece = Queen(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                            event.pos = (-1,-1)
-                        if coord[1] == promote_coord[1]+1:
-                            piece = Bishop(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]+2:
-                            piece = Knight(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]+3:
-                            piece = Rook(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                else:
-                    promote_coord = first_pieces.get_last_move()[2]
-                    if coord[0] == promote_coord[0]:
-                        if coord[1] == promote_coord[1]+3:
-                            piece = Queen(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]+2:
-                            piece = Bishop(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]+1:
-                            piece = Knight(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]:
-                            piece = Rook(promote_coord,has_moved=True)
-                            first_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                            event.pos = (-1,-1)
-        elif game_state == SECOND_PROMOTION:
-            if event.type == pygame.MOUSEBUTTONUP:
-                coord = pixel_to_coord(*event.pos)
-                if perspective == SECOND_PERSPECTIVE:
-                    promote_coord = second_pieces.get_last_move()[2]
-                    if coord[0] == promote_coord[0]:
-                        if coord[1] == promote_coord[1]:
-                            piece = Queen(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                            event.pos = (-1,-1)
-                        if coord[1] == promote_coord[1]-1:
-                            piece = Bishop(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]-2:
-                            piece = Knight(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]-3:
-                            piece = Rook(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                else:
-                    promote_coord = second_pieces.get_last_move()[2]
-                    if coord[0] == promote_coord[0]:
-                        if coord[1] == promote_coord[1]-3:
-                            piece = Queen(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]-2:
-                            piece = Bishop(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]-1:
-                            piece = Knight(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                        if coord[1] == promote_coord[1]:
-                            piece = Rook(promote_coord,has_moved=True)
-                            second_pieces.add(piece)
-                            Side.created_pieces.append((piece,Side.move_count-1))
-                            game_state = ACTIVE_GAME
-                            event.pos = (-1,-1)
-        elif game_state == CHECKMATE or game_state == STALEMATE:
-            if event.type == pygame.KEYUP:
-                #Toggle showing end screen
-                if event.key == pygame.K_b:
-                    show_end_screen = not show_end_screen
-                #Reset game
-                elif event.key == pygame.K_SPACE:
-                    #Reset game state trackers
-                    game_state = ACTIVE_GAME
-                    turn = FIRST_TURN
-                    show_end_screen = True
-                    #Reset sides and pieces
-                    Side.sides = []
-                    Side.move_made = False
-                    Side.moves = []
-                    Side.move_count = 0
-                    Side.dead_pieces = []
-                    Side.created_pieces = []
-                    #White pieces set up
-                    first_pieces = Side('white', Rook((0,7)),Knight((1,7)),
-                                        Bishop((2,7)),Queen((3,7)),
-                                        King((4,7)),Rook((7,7)),
-                                        Knight((6,7)),Bishop((5,7)))
-                    for x in range(8):
-                        first_pieces.add(Pawn((x,6)))
-                    #Black pieces set up
-                    second_pieces = Side('black', Rook((0,0)),Knight((1,0)),
-                                        Bishop((2,0)),Queen((3,0)),
-                                        King((4,0)),Rook((7,0)),
-                                        Knight((6,0)),Bishop((5,0)))
-                    for x in range(8):
-                        second_pieces.add(Pawn((x,1)))
+def mark_dirty(*coords):
+    """Marks board coordinates that have to be redrawn"""
+    dirty_squares.update(coords)
 
+def mark_all_dirty():
+    """Marks the whole screen to be redrawn"""
+    global full_redraw
+    full_redraw = True
 
+def mark_overlays():
+    """Marks the squares holding the last move, check and book highlights"""
+    for side in Side.sides:
+        mark_dirty(side.king.get_pos())
+        if side.get_last_move():
+            mark_dirty(*side.get_last_move()[1:3])
+    #The hint of the position before and of this one
+    mark_dirty(*book_hint)
+    update_book_hint()
+    mark_dirty(*book_hint)
+
+def update_book_hint():
+    """Finds the squares of the most played book move when hints are shown"""
+    global book_hint
+    book_hint = ()
+    if show_hints and book is not None:
+        moves = book.get_moves(Side.position)
+        if moves:
+            book_hint = (coords(moves[0][0][0]),coords(moves[0][0][1]))
+
+def draw_book_hint():
+    """Draws the squares of the book hint"""
+    for coord in book_hint:
+        screen.blit(get_image('avail_move'),coord_to_pixel(*coord))
+
+def draw_board():
+    """Draws the board, highlights and pieces for the game state"""
+    screen.blit(get_image('chess_board', alpha = False), (0,0))
     if game_state == ACTIVE_GAME:
-        #Draw background
-        screen.blit(board_background, (0,0))
-        #Update pieces
+        draw_book_hint()
         if turn == FIRST_TURN:
-            first_pieces.update(events)
-            game_state = first_pieces.get_info()
+            first_pieces.draw_selection()
             first_pieces.draw_check()
             second_pieces.draw_last_move()
         else:
-            second_pieces.update(events)
-            game_state = second_pieces.get_info()
+            second_pieces.draw_selection()
             second_pieces.draw_check()
             first_pieces.draw_last_move()
-        #Draw pieces
         first_pieces.draw(screen)
         second_pieces.draw(screen)
     elif game_state == FIRST_PROMOTION:
+        first_pieces.draw(screen)
+        second_pieces.draw(screen)
         if perspective == FIRST_PERSPECTIVE:
-            screen.blit(first_promote_surf,coord_to_pixel(*first_pieces.get_last_move()[2]))
+            screen.blit(first_pieces.get_promote_image(),coord_to_pixel(*first_pieces.get_last_move()[2]))
         else:
-            screen.blit(first_promote_surf,coord_to_pixel(first_pieces.get_last_move()[2][0],first_pieces.get_last_move()[2][1]+3))
+            screen.blit(first_pieces.get_promote_image(),coord_to_pixel(first_pieces.get_last_move()[2][0],first_pieces.get_last_move()[2][1]+3))
     elif game_state == SECOND_PROMOTION:
+        first_pieces.draw(screen)
+        second_pieces.draw(screen)
         if perspective == SECOND_PERSPECTIVE:
-            screen.blit(second_promote_surf,coord_to_pixel(*second_pieces.get_last_move()[2]))
+            screen.blit(second_pieces.get_promote_image(),coord_to_pixel(*second_pieces.get_last_move()[2]))
         else:
-            screen.blit(second_promote_surf,coord_to_pixel(second_pieces.get_last_move()[2][0],second_pieces.get_last_move()[2][1]-3))
+            screen.blit(second_pieces.get_promote_image(),coord_to_pixel(second_pieces.get_last_move()[2][0],second_pieces.get_last_move()[2][1]-3))
     elif game_state == CHECKMATE:
-        screen.blit(board_background, (0,0))
         if show_end_screen:
-            screen.blit(checkmate_surf, (160,160))
+            screen.blit(get_image('checkmate_screen', alpha = False), (160,160))
         else:
             first_pieces.draw(screen)
             second_pieces.draw(screen)
-    elif game_state == STALEMATE:
-        screen.blit(board_background, (0,0))
+    elif game_state == STALEMATE or game_state == REPETITION:
         if show_end_screen:
-            screen.blit(draw_surf,(160,160))
+            screen.blit(get_image('draw_screen', alpha = False),(160,160))
         else:
             first_pieces.draw(screen)
             second_pieces.draw(screen)
 
-    #Check to alter turn
-    if Side.move_made and game_state == ACTIVE_GAME:
-        toggle_turn()
-        Side.move_made = False
+def draw_dirty():
+    """Redraws only the dirty parts of the screen and pushes them to the
+    display"""
+    global full_redraw, eval_bar_dirty
+    bar = pygame.Rect(0,0,EVAL_BAR_WIDTH,HEIGHT*SQUARE_SIZE)
+    if full_redraw:
+        rects = [screen.get_rect()]
+        redraw_bar = show_eval
+    else:
+        rects = [pygame.Rect(coord_to_pixel(*coord),(SQUARE_SIZE,SQUARE_SIZE))
+                 for coord in dirty_squares]
+        #The overlay changes every frame
+        if show_stats:
+            rects.append(pygame.Rect((0,0),STATS_SIZE))
+        #The bar is redrawn when its score changed or the board under it was
+        redraw_bar = show_eval and (eval_bar_dirty or
+                                    bar.collidelist(rects) != -1)
+        if redraw_bar:
+            rects.append(bar)
+    #Every blit is clipped to the dirty rect being redrawn
+    for rect in rects:
+        screen.set_clip(rect)
+        draw_board()
+    screen.set_clip(None)
+    #The bar and overlay stay on top of whatever was redrawn under them
+    if redraw_bar:
+        draw_eval_bar()
+    if show_stats:
+        draw_stats()
+    if rects:
+        update_display(rects)
+    full_redraw = False
+    eval_bar_dirty = False
+    dirty_squares.clear()
+
+def update_eval_bar():
+    """Marks the evaluation bar to be redrawn when the position has changed
+    since it was drawn"""
+    global eval_key, eval_bar_dirty
+    if show_eval and Side.position.key != eval_key:
+        eval_key = Side.position.key
+        eval_bar_dirty = True
+
+def draw_eval_bar():
+    """Draws the share of the bar white's advantage fills, on white's side
+    of the board"""
+    score = Side.position.evaluate()
+    if Side.position.turn != WHITE:
+        score = -score
+    score = max(-EVAL_BAR_RANGE, min(score, EVAL_BAR_RANGE))
+    height = HEIGHT*SQUARE_SIZE
+    white = height * (score + EVAL_BAR_RANGE) // (2*EVAL_BAR_RANGE)
+    screen.fill(EVAL_BLACK, (0,0,EVAL_BAR_WIDTH,height))
+    if perspective == FIRST_PERSPECTIVE:
+        screen.fill(EVAL_WHITE, (0,height - white,EVAL_BAR_WIDTH,white))
+    else:
+        screen.fill(EVAL_WHITE, (0,0,EVAL_BAR_WIDTH,white))
+
+def update_display(rects):
+    """Pushes the redrawn parts of the screen to the display"""
+    pygame.display.update(rects)
+
+def instrumented_functions():
+    """Returns the (owner, name, label) of the functions the performance
+    statistics measure"""
+    module = sys.modules[__name__]
+    return ((Position, 'generate_legal_moves', 'generate_legal_moves'),
+            (Position, 'make_move', 'make_move'),
+            (Position, 'unmake_move', 'unmake_move'),
+            (Side, 'build_move_table', 'legal moves'),
+            (Side, 'get_info', 'Side.get_info'),
+            (Side, 'test_if_check', 'Side.test_if_check'),
+            (Piece, 'get_move_locs', 'Piece.get_move_locs'),
+            (module, 'collide_point', 'collide_point'),
+            (Side, 'undo_move', 'Side.undo_move'),
+            (module, 'draw_board', 'draw'),
+            (module, 'update_display', 'display'))
+
+def update_instrumentation():
+    """Measures the hot paths only while the overlay is shown or the
+    statistics are dumped"""
+    if show_stats or stats.file is not None:
+        stats.enable(instrumented_functions())
+    else:
+        stats.disable()
+
+def draw_stats():
+    """Draws the frame rate, frame time and hot path statistics of the
+    last frame"""
+    global stats_font
+    if stats_font is None:
+        stats_font = pygame.font.Font(None, STATS_LINE + 4)
+    frame = stats.frame
+    ms = frame.get('ms', {})
+    lines = [f'{frame.get("fps", 0):.0f} fps, frame '
+             f'{frame.get("frame_ms", 0):.2f} ms',
+             f'draw {ms.get("draw", 0):.2f} ms, display '
+             f'{ms.get("display", 0):.2f} ms',
+             f'legal moves {stats.last_seconds.get("legal moves", 0)*1000:.2f}'
+             f' ms'] + [f'{label} {stats.total_calls.get(label, 0)}'
+                        for label in stats.labels[:7]]
+    overlay = pygame.Surface(STATS_SIZE, pygame.SRCALPHA)
+    overlay.fill(STATS_BACKGROUND)
+    for row, line in enumerate(lines):
+        overlay.blit(stats_font.render(line, True, STATS_COLOR),
+                     (6, 6 + row*STATS_LINE))
+    screen.blit(overlay, (0,0))
 
-    pygame.display.update()
-    clock.tick(60)
\ No newline at end of file
+#Organization
+game_state = ACTIVE_GAME
+turn = FIRST_TURN
+show_end_screen = True
+flip_screen = False
+perspective = FIRST_PERSPECTIVE
+drawn_state = game_state
+
+#Screen and clock, made when the game starts
+screen = None
+clock = None
+
+#Computer opponent, the side it plays and its search in progress
+bitbases = None
+engine = None
+ai_side = None
+search = None
+ai_promotion = EMPTY
+book = None
+show_hints = False
+book_hint = ()
+
+#Rendering trackers, board coordinates to redraw or the whole screen
+dirty_squares = set()
+full_redraw = True
+
+#Performance statistics, measured only while shown or dumped
+stats = Stats()
+show_stats = False
+stats_font = None
+
+#Evaluation bar, redrawn only when the position changes
+show_eval = False
+eval_key = None
+eval_bar_dirty = False
+
+#Position a reset starts from and the one the game in play started from
+start_fen = START_FEN
+game_fen = START_FEN
+
+#Journal the moves are written to, opened when the game starts
+journal = None
+
+def main(argv = None):
+    """Opens the window and plays the game until it is closed"""
+    global screen, clock, bitbases, engine, book, start_fen, journal
+    global game_state, show_end_screen, flip_screen, perspective, drawn_state
+    global ai_side, show_hints, show_stats, show_eval
+    #Position the game starts from, given on the command line or the usual one
+    parser = argparse.ArgumentParser(description = 'Play chess')
+    parser.add_argument('fen', nargs = '?')
+    parser.add_argument('--stats', metavar = 'PATH',
+                        help = 'write the statistics of every frame to a '
+                               'file as JSON lines')
+    parser.add_argument('--journal', metavar = 'PATH', default = JOURNAL_PATH,
+                        help = 'file the game is written to and restored '
+                               'from, empty to keep no journal')
+    parser.add_argument('--lazy-images', action = 'store_true',
+                        help = 'load every image only when it is first '
+                               'drawn instead of after the first frame')
+    args = parser.parse_args(argv)
+    start_fen = args.fen or START_FEN
+
+    #Screen and clock set up
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH*SQUARE_SIZE,HEIGHT*SQUARE_SIZE))
+    pygame.display.set_caption("Chess")
+    clock = pygame.time.Clock()
+
+    #Computer opponent with the endgame tables and book that are there
+    bitbases = Bitbases()
+    engine = Engine(bitbases = bitbases)
+    book = Book(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+
+    if args.stats:
+        stats.open_dump(args.stats)
+    update_instrumentation()
+    #Carry on with the last game of the journal unless a position was given,
+    #the replayed moves are already in the journal
+    restored = writer = None
+    if args.journal:
+        archive = os.path.join(os.path.dirname(args.journal),
+                               JOURNAL_ARCHIVE)
+        restored, writer = open_journal(args.journal, archive)
+    if args.fen is not None:
+        restored = None
+    if restored is not None:
+        load_fen(restored[0].fen())
+        replay_moves(restored[1])
+    journal = writer
+    if restored is None:
+        load_fen(start_fen)
+
+    images_loaded = args.lazy_images
+    #Game loop
+    while True:
+        if stats.is_enabled():
+            stats.start_frame()
+        #Event loop
+        events = pygame.event.get()
+        for event in events:
+            if event.type == pygame.QUIT:
+                cancel_search()
+                stats.close_dump()
+                if journal is not None:
+                    journal.close()
+                pygame.quit()
+                return 0
+            #Show or hide the performance overlay in any state of the game
+            if event.type == pygame.KEYUP and event.key == pygame.K_i:
+                show_stats = not show_stats
+                update_instrumentation()
+                mark_all_dirty()
+            #Show or hide the evaluation bar
+            if event.type == pygame.KEYUP and event.key == pygame.K_e:
+                show_eval = not show_eval
+                mark_all_dirty()
+            if game_state == ACTIVE_GAME:
+                if event.type == pygame.KEYUP:
+                    #Reset game
+                    if event.key == pygame.K_r:
+                        load_fen(start_fen)
+                    #Undo move
+                    elif event.key == pygame.K_u:
+                        cancel_search()
+                        Side.undo_move()
+                        #Take back the computer's reply too so the player moves
+                        if (COLOR_NAMES[Side.position.turn] == ai_side and 
+                            Side.moves):
+                            Side.undo_move()
+                    #Print the position and the game to copy them out
+                    elif event.key == pygame.K_p:
+                        print(save_fen())
+                        print(save_pgn())
+                    #Show or hide the most played book move
+                    elif event.key == pygame.K_h:
+                        show_hints = not show_hints
+                        mark_overlays()
+                    #Let the computer play black, white or nobody
+                    elif event.key == pygame.K_a:
+                        cancel_search()
+                        if ai_side is None:
+                            ai_side = 'black'
+                        elif ai_side == 'black':
+                            ai_side = 'white'
+                        else:
+                            ai_side = None
+                    #Lock or release screen flipping
+                    elif event.key == pygame.K_f:
+                        flip_screen = not flip_screen
+                        mark_all_dirty()
+                        if flip_screen:
+                            if turn == FIRST_TURN:
+                                perspective = FIRST_PERSPECTIVE
+                            else:
+                                perspective = SECOND_PERSPECTIVE
+                            for side in Side.sides:
+                                for piece in side:
+                                    piece.update_rect()
+            elif game_state == FIRST_PROMOTION:
+                if event.type == pygame.MOUSEBUTTONUP:
+                    coord = pixel_to_coord(*event.pos)
+                    if perspective == FIRST_PERSPECTIVE:
+                        promote_coord = first_pieces.get_last_move()[2]
+                        if coord[0] == promote_coord[0]:
+                            if coord[1] == promote_coord[1]:
+                                piece = Queen(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                                event.pos = (-1,-1)
+                            if coord[1] == promote_coord[1]+1:
+                                piece = Bishop(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]+2:
+                                piece = Knight(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]+3:
+                                piece = Rook(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                    else:
+                        promote_coord = first_pieces.get_last_move()[2]
+                        if coord[0] == promote_coord[0]:
+                            if coord[1] == promote_coord[1]+3:
+                                piece = Queen(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]+2:
+                                piece = Bishop(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]+1:
+                                piece = Knight(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]:
+                                piece = Rook(promote_coord,has_moved=True)
+                                Side.promote(first_pieces,piece)
+                                game_state = ACTIVE_GAME
+                                event.pos = (-1,-1)
+            elif game_state == SECOND_PROMOTION:
+                if event.type == pygame.MOUSEBUTTONUP:
+                    coord = pixel_to_coord(*event.pos)
+                    if perspective == SECOND_PERSPECTIVE:
+                        promote_coord = second_pieces.get_last_move()[2]
+                        if coord[0] == promote_coord[0]:
+                            if coord[1] == promote_coord[1]:
+                                piece = Queen(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                                event.pos = (-1,-1)
+                            if coord[1] == promote_coord[1]-1:
+                                piece = Bishop(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]-2:
+                                piece = Knight(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]-3:
+                                piece = Rook(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                    else:
+                        promote_coord = second_pieces.get_last_move()[2]
+                        if coord[0] == promote_coord[0]:
+                            if coord[1] == promote_coord[1]-3:
+                                piece = Queen(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]-2:
+                                piece = Bishop(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]-1:
+                                piece = Knight(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                            if coord[1] == promote_coord[1]:
+                                piece = Rook(promote_coord,has_moved=True)
+                                Side.promote(second_pieces,piece)
+                                game_state = ACTIVE_GAME
+                                event.pos = (-1,-1)
+            elif (game_state == CHECKMATE or game_state == STALEMATE or 
+                  game_state == REPETITION):
+                if event.type == pygame.KEYUP:
+                    #Toggle showing end screen
+                    if event.key == pygame.K_b:
+                        show_end_screen = not show_end_screen
+                        mark_all_dirty()
+                    #Reset game
+                    elif event.key == pygame.K_SPACE:
+                        load_fen(start_fen)
+                    #Print the position and the game to copy them out
+                    elif event.key == pygame.K_p:
+                        print(save_fen())
+                        print(save_pgn())
+
+
+        if game_state == ACTIVE_GAME:
+            #Update pieces, or let the computer move for its side
+            if turn == FIRST_TURN:
+                if ai_side == first_pieces.get_side():
+                    play_computer_move()
+                else:
+                    first_pieces.update(events)
+                game_state = first_pieces.get_info()
+            else:
+                if ai_side == second_pieces.get_side():
+                    play_computer_move()
+                else:
+                    second_pieces.update(events)
+                game_state = second_pieces.get_info()
+            #The computer picks its promotion without the prompt
+            if ai_promotion and game_state == FIRST_PROMOTION:
+                promote_computer_pawn(first_pieces)
+                game_state = ACTIVE_GAME
+            elif ai_promotion and game_state == SECOND_PROMOTION:
+                promote_computer_pawn(second_pieces)
+                game_state = ACTIVE_GAME
+
+        #Check to alter turn
+        if Side.move_made and game_state == ACTIVE_GAME:
+            toggle_turn()
+            Side.move_made = False
+
+        #Redraw everything when the game state changes what is shown
+        if game_state != drawn_state:
+            drawn_state = game_state
+            mark_all_dirty()
+            announce_result()
+        update_eval_bar()
+        draw_dirty()
+        #The window shows with the images it needs, the rest load after it
+        #so the first promotion or check does not stall a frame
+        if not images_loaded:
+            preload_images()
+            images_loaded = True
+        if stats.is_enabled():
+            stats.end_frame(fps = clock.get_fps())
+        clock.tick(60)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Measures cold start: how long a fresh interpreter takes to import each
+module and how long a pool of processes takes to return its first result
+
+Each import is timed in a new process, so nothing is cached in memory, and
+the best and median of several runs are reported. The rules modules must
+not load pygame, only the game window does. Run it with:
+
+    python coldstart.py
+    python coldstart.py --runs 20 --limit 150
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+#Modules timed, the rules and tools first and the game window last
+MODULES = ('position', 'engine', 'perft', 'pgn', 'book', 'bitbase', 'simulate',
+           'uci', 'instrument', 'planes', 'server', 'loadgen', 'journal',
+           'chess')
+#Modules that are allowed to load pygame
+WINDOW_MODULES = ('chess',)
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+IMPORT_SCRIPT = ('import sys, time\n'
+                 'start = time.perf_counter()\n'
+                 'import {module}\n'
+                 'print(time.perf_counter() - start, "pygame" in sys.modules)')
+
+def time_import(module):
+    """Returns the seconds a fresh interpreter takes to import the module,
+    and if pygame was loaded with it"""
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT = '1')
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(module = module)],
+        cwd = DIRECTORY, env = env, capture_output = True, text = True,
+        check = True).stdout.split()
+    return float(output[-2]), output[-1] == 'True'
+
+def time_interpreter():
+    """Returns the seconds a fresh interpreter takes to start and exit"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check = True)
+    return time.perf_counter() - start
+
+def _worker_task():
+    """Sets up the start position in a worker, as the tools' workers do"""
+    from position import Position
+    return Position().key
+
+def time_pool(method, workers):
+    """Returns the seconds a pool of processes started with the method takes
+    to return a result from every worker"""
+    context = multiprocessing.get_context(method)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, mp_context = context) as pool:
+        futures = [pool.submit(_worker_task) for _ in range(workers)]
+        for future in futures:
+            future.result()
+        seconds = time.perf_counter() - start
+    return seconds
+
+def main(argv = None):
+    """Reports cold start times, exits with 1 when a rules module is over
+    the limit or loads pygame"""
+    parser = argparse.ArgumentParser(description = 'Measure cold start')
+    parser.add_argument('--runs', type = int, default = 10)
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--limit', type = float,
+                        help = 'milliseconds a rules module may take to '
+                               'import')
+    args = parser.parse_args(argv)
+    failed = False
+    runs = [time_interpreter() for _ in range(args.runs)]
+    print(f'{"interpreter":<12} best {min(runs)*1000:7.1f} ms  median '
+          f'{statistics.median(runs)*1000:7.1f} ms')
+    for module in MODULES:
+        results = [time_import(module) for _ in range(args.runs)]
+        runs = [result[0] for result in results]
+        pygame = any(result[1] for result in results)
+        notes = []
+        if pygame:
+            notes.append('loads pygame')
+            if module not in WINDOW_MODULES:
+                failed = True
+        if (args.limit is not None and module not in WINDOW_MODULES and
+            min(runs)*1000 > args.limit):
+            notes.append('over the limit')
+            failed = True
+        print(f'{module:<12} best {min(runs)*1000:7.1f} ms  median '
+              f'{statistics.median(runs)*1000:7.1f} ms  {", ".join(notes)}')
+    for method in multiprocessing.get_all_start_methods():
+        runs = [time_pool(method, args.workers)
+                for _ in range(max(args.runs // 2, 1))]
+        print(f'{method + " pool":<12} best {min(runs)*1000:7.1f} ms  median '
+              f'{statistics.median(runs)*1000:7.1f} ms  for {args.workers} '
+              f'workers')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
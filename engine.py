@@ -0,0 +1,449 @@
+"""Computer opponent searching the Position rules with alpha-beta
+
+The search is an iterative deepening negamax with alpha-beta pruning, a
+transposition table keyed by the Zobrist key of the position and a
+quiescence search over captures. It always works on its own copy of the
+position, so SearchWorker can run it on a background thread while the game
+keeps drawing and handling input.
+
+ParallelSearch spreads the root moves over a pool of processes for analysis
+on many cores. Run this file to analyse a position:
+
+    python engine.py --fen "<fen>" --depth 6 --workers 16
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import (ProcessPoolExecutor, wait,
+                                FIRST_COMPLETED)
+from bitbase import Bitbases
+from book import Book
+from position import (Position, START_FEN, PAWN, VALUES, piece_type,
+                      move_name)
+
+#Score of a checkmate, reduced by the moves needed to reach it
+MATE = 100000
+INFINITY = 1000000
+MAX_DEPTH = 64
+#Scores this close to MATE are forced mates, endgame tables give long ones
+MATE_SCORES = MATE - 1000
+#Nodes searched between checks of the clock and the stop flag
+CHECK_INTERVAL = 1024
+#Transposition table bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+class SearchStopped(Exception):
+    """Raised inside the search when it runs out of time or is cancelled"""
+
+class SearchLimits:
+    """Stop event, deadline and node count of one search, passed through
+    the search so a cancelled search never reads the limits of the next"""
+    def __init__(self, stop = None, movetime = None):
+        """Starts counting nodes, movetime is in seconds from now"""
+        self.stop = stop
+        self.deadline = None
+        if movetime is not None:
+            self.deadline = time.perf_counter() + movetime
+        self.nodes = 0
+
+    def count(self):
+        """Counts a node and stops the search when cancelled or out of
+        time"""
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            if self.stop is not None and self.stop.is_set():
+                raise SearchStopped()
+            if (self.deadline is not None and
+                time.perf_counter() > self.deadline):
+                raise SearchStopped()
+
+def evaluate(position):
+    """Returns the static score of the position for the side to move, kept
+    up to date by the position as pieces move"""
+    return position.evaluate()
+
+def score_to_table(score, ply):
+    """Returns a score to store in the transposition table, mates counted
+    from the position rather than from the root"""
+    if score > MATE_SCORES:
+        return score + ply
+    if score < -MATE_SCORES:
+        return score - ply
+    return score
+
+def score_from_table(score, ply):
+    """Returns a score read from the transposition table counted from the
+    root again"""
+    if score > MATE_SCORES:
+        return score - ply
+    if score < -MATE_SCORES:
+        return score + ply
+    return score
+
+def is_capture(position, move):
+    """Returns true if the move takes a piece or promotes"""
+    start, end, promotion = move
+    return bool(position.board[end] or promotion or 
+                (end == position.ep and 
+                 piece_type(position.board[start]) == PAWN))
+
+class Engine:
+    """Alpha-beta searcher that keeps its transposition table between
+    searches"""
+    def __init__(self, table_size = 1000000, bitbases = None):
+        """Initiates the engine with an empty transposition table, endgames
+        found in the bitbases are scored without searching them"""
+        self.table = {}
+        self.table_size = table_size
+        self.bitbases = bitbases
+
+    def clear(self):
+        """Forgets everything learnt in previous searches"""
+        self.table.clear()
+
+    def search(self, position, depth = MAX_DEPTH, movetime = None,
+               stop = None, info = None):
+        """Returns the best move found and its score, searching deeper until
+        the depth or the movetime in seconds is reached, or stop is set
+
+        info is called with (depth, score, nodes, seconds, best move) after
+        every completed depth."""
+        position = position.copy()
+        limits = SearchLimits(stop, movetime)
+        start = time.perf_counter()
+        moves = position.generate_legal_moves()
+        if not moves:
+            return None, (-MATE if position.is_check() else 0)
+        best_move, best_score = moves[0], 0
+        for current in range(1, depth + 1):
+            try:
+                score = self._negamax(position, current, -INFINITY, INFINITY,
+                                      0, limits)
+            except SearchStopped:
+                break
+            entry = self.table.get(position.key)
+            if entry and entry[3]:
+                best_move, best_score = entry[3], score
+            seconds = time.perf_counter() - start
+            if info:
+                info(current, best_score, limits.nodes, seconds, best_move)
+            #Stop early on a forced mate or when the next depth cannot finish
+            if abs(score) > MATE - MAX_DEPTH:
+                break
+            if (limits.deadline and
+                time.perf_counter() + seconds > limits.deadline):
+                break
+        return best_move, best_score
+
+    def _order(self, position, moves, best):
+        """Sorts moves with the best known one first, then captures of the
+        most valuable pieces by the least valuable ones"""
+        board = position.board
+        def score(move):
+            if move == best:
+                return 100000
+            start, end, promotion = move
+            value = VALUES[promotion] * 10
+            if board[end]:
+                value += (VALUES[piece_type(board[end])] * 10 - 
+                          VALUES[piece_type(board[start])] // 10)
+            return value
+        moves.sort(key = score, reverse = True)
+        return moves
+
+    def _probe(self, position, ply):
+        """Returns the exact score of an endgame in the bitbases, None for
+        other positions"""
+        if self.bitbases is None:
+            return None
+        result = self.bitbases.probe(position)
+        if result is None:
+            return None
+        outcome, plies = result
+        if outcome > 0:
+            return MATE - ply - plies
+        if outcome < 0:
+            return -MATE + ply + plies
+        return 0
+
+    def _negamax(self, position, depth, alpha, beta, ply, limits):
+        """Returns the score of the position searched to the depth"""
+        limits.count()
+        #Repeated positions and the fifty move rule are draws
+        if ply and (position.repetitions.get(position.key, 0) > 1 or 
+                    position.halfmove >= 100):
+            return 0
+        if ply:
+            score = self._probe(position, ply)
+            if score is not None:
+                return score
+        in_check = position.is_check()
+        #Look one move further when in check
+        if in_check:
+            depth += 1
+        if depth <= 0:
+            return self._quiesce(position, alpha, beta, ply, limits)
+        original_alpha = alpha
+        entry = self.table.get(position.key)
+        best = None
+        if entry:
+            entry_depth, flag, score, best = entry
+            score = score_from_table(score, ply)
+            if ply and entry_depth >= depth:
+                if flag == EXACT:
+                    return score
+                if flag == LOWER and score >= beta:
+                    return score
+                if flag == UPPER and score <= alpha:
+                    return score
+        moves = position.generate_legal_moves()
+        if not moves:
+            return -MATE + ply if in_check else 0
+        best_score = -INFINITY
+        best_move = None
+        for move in self._order(position, moves, best):
+            position.make_move(move)
+            score = -self._negamax(position, depth - 1, -beta, -alpha,
+                                   ply + 1, limits)
+            position.unmake_move()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self._store(position.key, (depth, flag,
+                                   score_to_table(best_score, ply), best_move))
+        return best_score
+
+    def _store(self, key, entry):
+        """Stores a table entry, once the table holds table_size entries the
+        one written longest ago makes room"""
+        table = self.table
+        #Written again at the end, the dict keeps the order of the writes
+        if table.pop(key, None) is None and len(table) >= self.table_size:
+            del table[next(iter(table))]
+        table[key] = entry
+
+    def _quiesce(self, position, alpha, beta, ply, limits):
+        """Returns the score once the captures have been played out"""
+        limits.count()
+        score = self._probe(position, ply)
+        if score is not None:
+            return score
+        in_check = position.is_check()
+        moves = position.generate_legal_moves()
+        if in_check:
+            #Every evasion has to be looked at
+            if not moves:
+                return -MATE + ply
+            best_score = -INFINITY
+        else:
+            best_score = evaluate(position)
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+            moves = [move for move in moves if is_capture(position, move)]
+        for move in self._order(position, moves, None):
+            position.make_move(move)
+            score = -self._quiesce(position, -beta, -alpha, ply + 1,
+                                   limits)
+            position.unmake_move()
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+class SearchWorker:
+    """Runs an engine search on a background thread"""
+    def __init__(self, engine, position, depth = MAX_DEPTH, movetime = 1.0):
+        """Starts searching a copy of the position right away"""
+        self.engine = engine
+        self.position = position.copy()
+        self.depth = depth
+        self.movetime = movetime
+        self.stop_event = threading.Event()
+        self.move = None
+        self.score = 0
+        self.done = False
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def _run(self):
+        """Searches and stores the result"""
+        self.move, self.score = self.engine.search(
+            self.position, self.depth, self.movetime, self.stop_event)
+        self.done = True
+
+    def is_done(self):
+        """Returns true once the search has finished"""
+        return self.done
+
+    def get_move(self):
+        """Returns the best move, None until the search is done or if it was
+        cancelled"""
+        if not self.done or self.stop_event.is_set():
+            return None
+        return self.move
+
+    def cancel(self):
+        """Aborts the search, it stops within a few thousand nodes"""
+        self.stop_event.set()
+
+#Engine of each worker process, its table is kept between root moves
+_worker_engine = None
+
+def _search_root_move(packed, move, depth, alpha, deadline):
+    """Searches one root move to the depth in a worker process, scores at or
+    below alpha only tell the move is no better, and returns the move, its
+    score, the nodes searched and whether the search finished"""
+    global _worker_engine
+    if _worker_engine is None:
+        _worker_engine = Engine(bitbases = Bitbases())
+    engine = _worker_engine
+    position = Position.unpack(packed)
+    position.make_move(move)
+    movetime = None
+    if deadline is not None:
+        movetime = max(deadline - time.time(), 0)
+    limits = SearchLimits(movetime = movetime)
+    try:
+        score = -engine._negamax(position, depth - 1, -INFINITY, -alpha, 1,
+                                 limits)
+    except SearchStopped:
+        return move, -INFINITY, limits.nodes, False
+    return move, score, limits.nodes, True
+
+class ParallelSearch:
+    """Analysis search splitting the root moves over a process pool
+
+    Positions are sent to the workers packed into bytes, each worker keeps
+    its own engine and transposition table between tasks. Every depth
+    searches the best move of the last depth first, then the others with
+    its score, or the best found since, as alpha."""
+    def __init__(self, workers = None):
+        """Starts the pool of worker processes"""
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.nodes = 0
+
+    def close(self):
+        """Shuts the worker processes down"""
+        self.pool.shutdown(cancel_futures = True)
+
+    def _search_depth(self, packed, moves, depth, deadline):
+        """Returns the (move, score, nodes, finished) of every root move
+        searched to the depth, None if the time ran out first"""
+        timeout = None
+        results = []
+        alpha = -INFINITY
+        waiting = list(moves[1:])
+        running = {self.pool.submit(_search_root_move, packed, moves[0],
+                                    depth, alpha, deadline)}
+        while running:
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0) + 0.1
+            done, running = wait(running, timeout,
+                                 return_when = FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                self.nodes += result[2]
+                results.append(result)
+                alpha = max(alpha, result[1])
+            if not done or not all(result[3] for result in results):
+                for future in running:
+                    future.cancel()
+                return None
+            #The first move sets alpha before the others start, later moves
+            #start with the best score found so far
+            while waiting and len(running) < self.workers:
+                running.add(self.pool.submit(_search_root_move, packed,
+                                             waiting.pop(0), depth, alpha,
+                                             deadline))
+        return results
+
+    def search(self, position, depth = MAX_DEPTH, movetime = None,
+               info = None):
+        """Returns the best move and its score like Engine.search"""
+        moves = position.generate_legal_moves()
+        if not moves:
+            return None, (-MATE if position.is_check() else 0)
+        packed = position.pack()
+        deadline = None if movetime is None else time.time() + movetime
+        start = time.perf_counter()
+        self.nodes = 0
+        best_move, best_score = moves[0], 0
+        for current in range(1, depth + 1):
+            results = self._search_depth(packed, moves, current, deadline)
+            #Only trust a depth every root move finished
+            if results is None:
+                break
+            #Moves that failed low keep their order behind the best one
+            results.sort(key = lambda result: result[1], reverse = True)
+            moves = [result[0] for result in results]
+            best_move, best_score = results[0][0], results[0][1]
+            seconds = time.perf_counter() - start
+            if info:
+                info(current, best_score, self.nodes, seconds, best_move)
+            if abs(best_score) > MATE - MAX_DEPTH:
+                break
+        return best_move, best_score
+
+def print_info(depth, score, nodes, seconds, move):
+    """Prints the progress of an analysis"""
+    nps = nodes / seconds if seconds > 0 else 0
+    print(f'depth {depth:>2} score {score:>7} nodes {nodes:>10} '
+          f'time {seconds:8.3f}s nps {nps:9.0f} move {move_name(move)}',
+          flush = True)
+
+def main(argv = None):
+    """Analyses a position from the command line"""
+    parser = argparse.ArgumentParser(description = 'Analyse a position')
+    parser.add_argument('--fen', default = START_FEN)
+    parser.add_argument('--depth', type = int, default = 5)
+    parser.add_argument('--movetime', type = float,
+                        help = 'seconds to search for')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(),
+                        help = 'processes to split the root moves over, 1 '
+                               'searches in this process')
+    parser.add_argument('--book', help = 'Polyglot book to play from first')
+    args = parser.parse_args(argv)
+    position = Position(args.fen)
+    if args.book:
+        book = Book(args.book)
+        try:
+            move = book.choose(position)
+        finally:
+            book.close()
+        if move is not None:
+            print(f'bestmove {move_name(move)} (book)')
+            return 0
+    if args.workers > 1:
+        searcher = ParallelSearch(args.workers)
+        try:
+            move, score = searcher.search(position, args.depth,
+                                          args.movetime, print_info)
+        finally:
+            searcher.close()
+    else:
+        engine = Engine(bitbases = Bitbases())
+        move, score = engine.search(position, args.depth, args.movetime,
+                                    info = print_info)
+    print(f'bestmove {move_name(move) if move else "(none)"}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Opt-in call counters and timers for the hot paths of the game
+
+Nothing is measured until enable is called: it swaps each named function or
+method for a wrapper that counts and times its calls, and disable puts the
+originals back. Code that is not being measured therefore runs exactly as
+it was written, so the instrumentation can stay in for every build. Times
+are inclusive, a function that calls another measured one counts the time
+of both.
+
+Statistics are gathered per frame between start_frame and end_frame, and
+each finished frame can be written to a file as one JSON object per line.
+Only calls made on the thread that called enable are counted, so a search
+running on another thread neither shows up in the frame nor races on the
+counters.
+"""
+import functools
+import json
+import threading
+import time
+
+class Stats:
+    """Counts and times of the wrapped functions, per frame and in total"""
+    def __init__(self):
+        """Initiates the statistics with nothing wrapped"""
+        #(owner, name, original attribute) of every wrapped function
+        self.originals = []
+        self.labels = []
+        #Calls and seconds of the frame being measured
+        self.calls = {}
+        self.seconds = {}
+        #Calls since enabled and the seconds of the latest call
+        self.total_calls = {}
+        self.last_seconds = {}
+        self.frame_count = 0
+        self.frame_start = None
+        self.frame = {}
+        self.file = None
+        #Thread whose calls are counted
+        self.thread = None
+
+    def is_enabled(self):
+        """Returns true while the functions are wrapped"""
+        return bool(self.originals)
+
+    def enable(self, targets):
+        """Wraps the (owner, name, label) targets, the owner being a class or
+        a module"""
+        if self.originals:
+            return
+        self.thread = threading.get_ident()
+        for owner, name, label in targets:
+            attribute = owner.__dict__[name]
+            if isinstance(attribute, staticmethod):
+                wrapper = staticmethod(self._wrap(attribute.__func__, label))
+            else:
+                wrapper = self._wrap(attribute, label)
+            self.originals.append((owner, name, attribute))
+            self.labels.append(label)
+            setattr(owner, name, wrapper)
+
+    def disable(self):
+        """Puts the original functions back"""
+        for owner, name, attribute in reversed(self.originals):
+            setattr(owner, name, attribute)
+        self.originals = []
+        self.labels = []
+        self.frame_start = None
+
+    def _wrap(self, function, label):
+        """Returns the function counting and timing its calls"""
+        calls, seconds = self.calls, self.seconds
+        total_calls, last_seconds = self.total_calls, self.last_seconds
+        counter = time.perf_counter
+        get_ident = threading.get_ident
+        thread = self.thread
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if get_ident() != thread:
+                return function(*args, **kwargs)
+            start = counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = counter() - start
+                calls[label] = calls.get(label, 0) + 1
+                seconds[label] = seconds.get(label, 0) + elapsed
+                total_calls[label] = total_calls.get(label, 0) + 1
+                last_seconds[label] = elapsed
+        return wrapper
+
+    def start_frame(self):
+        """Starts measuring a frame"""
+        self.calls.clear()
+        self.seconds.clear()
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self, **extra):
+        """Finishes the frame, keeps its record with any extra values and
+        writes it to the dump file if one is open"""
+        if self.frame_start is None:
+            return
+        self.frame_count += 1
+        self.frame = {
+            'frame': self.frame_count,
+            'frame_ms': (time.perf_counter() - self.frame_start) * 1000,
+            **extra,
+            'calls': dict(self.calls),
+            'ms': {label: seconds * 1000
+                   for label, seconds in self.seconds.items()}}
+        self.frame_start = None
+        if self.file is not None:
+            self.file.write(json.dumps(self.frame) + '\n')
+
+    def open_dump(self, path):
+        """Writes every finished frame to a file as a JSON line"""
+        self.close_dump()
+        self.file = open(path, 'w', encoding = 'utf-8')
+
+    def close_dump(self):
+        """Closes the dump file"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,227 @@
+"""Append-only journal of the games played, so a game survives the process
+dying and finished games can be scanned in bulk
+
+A journal starts with MAGIC and then holds records back to back. A move is
+two bytes, a clear top bit followed by the promotion, start and end squares
+in 3, 6 and 6 bits, an undo is the single byte UNDO and the start of a game
+is the byte RESET followed by its position compressed by
+Position.compress. Records are written by a background thread that
+fsyncs them in batches, so writing never waits on the disk. A record torn
+by a crash is dropped when the journal is read and cut off when it is
+opened again. open_journal moves the finished games to a new file in an
+archive directory, so the journal only holds the game in play and opens
+as fast however many games were played. Print the games of journals with:
+
+    python journal.py game.journal
+    python journal.py archive/*.journal --pgn
+"""
+import argparse
+import mmap
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from position import Position, COMPACT_SIZE
+
+MAGIC = b'CHESSJ1\n'
+#Record tags, moves have the top bit clear
+UNDO = 0x80
+RESET = 0x81
+#A move or undo record, and a game: its reset record and the ones after it
+RECORD = re.compile(rb'[\x00-\x7f].|\x80', re.DOTALL)
+GAME = re.compile(rb'\x81(.{%d})((?:[\x00-\x7f].|\x80)*)' % COMPACT_SIZE,
+                  re.DOTALL)
+#Seconds written records may wait before they are synced to disk
+SYNC_INTERVAL = 0.5
+
+def encode_move(move):
+    """Returns the two bytes of a move record"""
+    start, end, promotion = move
+    return (promotion << 12 | start << 6 | end).to_bytes(2, 'big')
+
+def decode_moves(records):
+    """Returns the moves left by the move and undo records of a game"""
+    moves = []
+    for record in RECORD.findall(records):
+        if record[0] == UNDO:
+            if moves:
+                moves.pop()
+        else:
+            word = record[0] << 8 | record[1]
+            moves.append(((word >> 6) & 63, word & 63, word >> 12))
+    return moves
+
+def scan(data):
+    """Returns the games of journal bytes as (offset, start position,
+    records) tuples and the length of the records that could be read"""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a journal')
+    games = []
+    index = len(MAGIC)
+    #The moves of a game are skipped in one match, a record torn by a crash
+    #does not match and ends the scan
+    while True:
+        match = GAME.match(data, index)
+        if match is None:
+            break
+        games.append((index, match.group(1), match.group(2)))
+        index = match.end()
+    return games, index
+
+def _read_records(path):
+    """Returns the games of a journal file, read through a memory map, as
+    (offset, start position, records) tuples"""
+    with open(path, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return []
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            return scan(data)[0]
+
+def read_games(path):
+    """Returns the games of a journal file as (start position, moves)
+    tuples with the position compressed"""
+    return [(start, decode_moves(records))
+            for offset, start, records in _read_records(path)]
+
+def _write_file(path, data):
+    """Writes a whole file and syncs it before it replaces the old one"""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+def _archive_path(archive):
+    """Returns a new file name in the archive directory"""
+    os.makedirs(archive, exist_ok = True)
+    name = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(archive, f'{name}.journal')
+    number = 1
+    while os.path.exists(path):
+        path = os.path.join(archive, f'{name}-{number}.journal')
+        number += 1
+    return path
+
+def open_journal(path, archive = None):
+    """Returns the Position the last game of a journal started from and its
+    moves, or None without one, and a JournalWriter appending to the
+    journal, which is read once. With an archive directory the games before
+    the last are moved to a new file in it first"""
+    game = None
+    length = 0
+    finished = kept = None
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0,
+                           access = mmap.ACCESS_READ) as data:
+                games, length = scan(data)
+                if games:
+                    offset, start, records = games[-1]
+                    game = Position.decompress(start), decode_moves(records)
+                    if archive is not None and offset > len(MAGIC):
+                        finished = data[:offset]
+                        kept = MAGIC + data[offset:length]
+    if finished is not None:
+        #Archived before the journal is cut, a crash in between only
+        #archives the games twice
+        _write_file(_archive_path(archive), finished)
+        _write_file(path, kept)
+        length = len(kept)
+    return game, JournalWriter(path, length)
+
+class JournalWriter:
+    """Appends records to a journal on a background thread"""
+    def __init__(self, path, length = None, interval = SYNC_INTERVAL):
+        """Opens the journal, creating it or cutting off a torn record at
+        its end, and starts the writing thread. length is the length of the
+        records when the journal was just scanned"""
+        self.interval = interval
+        if length is None:
+            length = 0
+            if os.path.exists(path) and os.path.getsize(path):
+                with open(path, 'rb') as file:
+                    with mmap.mmap(file.fileno(), 0,
+                                   access = mmap.ACCESS_READ) as data:
+                        length = scan(data)[1]
+        self.file = open(path, 'a+b')
+        self.file.truncate(length)
+        if not length:
+            self.file.write(MAGIC)
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def write_move(self, move):
+        """Records a move played"""
+        self.queue.put(encode_move(move))
+
+    def write_undo(self):
+        """Records that the last move was taken back"""
+        self.queue.put(bytes((UNDO,)))
+
+    def write_reset(self, position):
+        """Records the start of a game from a position"""
+        self.queue.put(bytes((RESET,)) + position.compress())
+
+    def close(self):
+        """Writes and syncs every record left, then closes the journal"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _sync(self):
+        """Pushes the written records to the disk"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _run(self):
+        """Writes records as they come and syncs them once the oldest one
+        not yet synced has waited for the interval"""
+        unsynced = None
+        while True:
+            timeout = None
+            if unsynced is not None:
+                timeout = max(unsynced + self.interval - time.monotonic(), 0)
+            try:
+                data = self.queue.get(timeout = timeout)
+            except queue.Empty:
+                data = b''
+            if data is None:
+                break
+            if data:
+                self.file.write(data)
+                if unsynced is None:
+                    unsynced = time.monotonic()
+            if (unsynced is not None and
+                time.monotonic() - unsynced >= self.interval):
+                self._sync()
+                unsynced = None
+        self._sync()
+        self.file.close()
+
+def main(argv = None):
+    """Prints the games of journals from the command line"""
+    parser = argparse.ArgumentParser(description = 'Read game journals')
+    parser.add_argument('files', nargs = '+')
+    parser.add_argument('--pgn', action = 'store_true',
+                        help = 'print every game as PGN')
+    args = parser.parse_args(argv)
+    #Only imported when games are printed
+    from pgn import write_game
+    start = time.perf_counter()
+    games = moves = 0
+    for path in args.files:
+        for position, played in read_games(path):
+            games += 1
+            moves += len(played)
+            if args.pgn:
+                print(write_game(played, Position.decompress(position).fen()))
+    seconds = max(time.perf_counter() - start, 1e-9)
+    print(f'{games} games, {moves} moves in {seconds:.3f}s: '
+          f'{moves / seconds:.0f} moves/s')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Load generator for server.py: plays many games at once over a number of
+connections and reports the move latency and games hosted
+
+Every connection opens its share of the games, then moves in each of them
+in turn with a random legal move until the game ends or reaches --plies.
+A share of the games can be played against the computer. The server is
+asked how many games it hosts while the load runs.
+
+    python server.py &
+    python loadgen.py --games 2000 --connections 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from server import HOST, PORT, LINE_LIMIT
+
+#Seconds between asking the server how many games it hosts
+INFO_INTERVAL = 0.25
+
+class Connection:
+    """A client connection sending one request at a time"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host, port):
+        """Returns a new connection to the server"""
+        reader, writer = await asyncio.open_connection(host, port,
+                                                       limit = LINE_LIMIT)
+        return cls(reader, writer)
+
+    async def request(self, **request):
+        """Sends a request and returns the reply, raises ValueError when the
+        server answers with an error"""
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('server closed the connection')
+        reply = json.loads(line)
+        if not reply['ok']:
+            raise ValueError(reply['error'])
+        return reply
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def play_games(host, port, games, plies, bots, rng, latencies):
+    """Plays games over one connection, moving in each in turn, and adds
+    the seconds every move took to latencies per kind of game"""
+    connection = await Connection.open(host, port)
+    try:
+        states = []
+        for _ in range(games):
+            bot = 'black' if rng.random() < bots else None
+            states.append(await connection.request(op = 'new', bot = bot))
+        while states:
+            playing = []
+            for state in states:
+                kind = 'bot' if state['bot'] else 'human'
+                start = time.perf_counter()
+                state = await connection.request(
+                    op = 'move', game = state['game'],
+                    move = rng.choice(state['legal']))
+                latencies[kind].append(time.perf_counter() - start)
+                if state['result'] is None and len(state['moves']) < plies:
+                    playing.append(state)
+                else:
+                    await connection.request(op = 'close',
+                                             game = state['game'])
+            states = playing
+    finally:
+        await connection.close()
+
+async def watch_games(host, port, peak, stop):
+    """Keeps the most games the server hosted at once until stopped"""
+    connection = await Connection.open(host, port)
+    try:
+        while not stop.is_set():
+            info = await connection.request(op = 'info')
+            peak[0] = max(peak[0], info['games'])
+            try:
+                await asyncio.wait_for(stop.wait(), INFO_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await connection.close()
+
+def percentile(values, share):
+    """Returns the value below which the share of the sorted values lie"""
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+async def run(args):
+    """Runs the load and prints the report"""
+    rng = random.Random(args.seed)
+    latencies = {'human': [], 'bot': []}
+    peak = [0]
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_games(args.host, args.port, peak,
+                                              stop))
+    share, extra = divmod(args.games, args.connections)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        play_games(args.host, args.port, share + (index < extra), args.plies,
+                   args.bots, random.Random(rng.random()), latencies)
+        for index in range(args.connections)))
+    seconds = max(time.perf_counter() - start, 1e-9)
+    stop.set()
+    await watcher
+    moves = sum(len(values) for values in latencies.values())
+    print(f'{args.games} games, {moves} moves in {seconds:.2f}s over '
+          f'{args.connections} connections: {moves / seconds:.0f} moves/s, '
+          f'{peak[0]} games hosted at once')
+    for kind, values in latencies.items():
+        if values:
+            values.sort()
+            print(f'{kind:<6} moves {len(values):>8}  p50 '
+                  f'{percentile(values, 0.5)*1000:8.2f} ms  p99 '
+                  f'{percentile(values, 0.99)*1000:8.2f} ms')
+
+def main(argv = None):
+    """Puts load on a running server from the command line"""
+    parser = argparse.ArgumentParser(description = 'Load a game server')
+    parser.add_argument('--host', default = HOST)
+    parser.add_argument('--port', type = int, default = PORT)
+    parser.add_argument('--games', type = int, default = 1000)
+    parser.add_argument('--connections', type = int, default = 50)
+    parser.add_argument('--plies', type = int, default = 40,
+                        help = 'plies after which a game is closed')
+    parser.add_argument('--bots', type = float, default = 0.0,
+                        help = 'share of games played against the computer')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Counts the leaf nodes of the move tree to check and time the move
+generator
+
+Run with a depth to count from the start position, add --fen to count from
+another position, --divide to break the count down per move, or --suite to
+check every reference position against its published counts and that
+invalid positions are refused.
+
+    python perft.py 4
+    python perft.py 3 --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -" --divide
+    python perft.py 4 --suite
+"""
+import argparse
+import sys
+import time
+from position import Position, START_FEN, move_name
+
+#Reference positions and their published leaf counts per depth
+SUITE = (
+    ('start', START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ('kiwipete',
+     'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ('en passant and pins',
+     '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ('castling and promotion',
+     'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ('promotion with discovered check',
+     'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ('middlegame',
+     'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+)
+#Positions that must be refused, the suite checks they raise ValueError
+INVALID = (
+    ('en passant on the wrong rank',
+     'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e5 0 2'),
+    ('en passant for the side to move',
+     'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e3 0 2'),
+    ('en passant without a pawn behind',
+     'rnbqkbnr/pppp1ppp/8/8/4p3/8/PPPPPPPP/RNBQKBNR w KQkq d6 0 2'),
+    ('en passant on an occupied square',
+     'rnbqkbnr/ppp2ppp/3p4/3Pp3/8/8/PPP1PPPP/RNBQKBNR w KQkq d6 0 3'),
+)
+
+def perft(position, depth):
+    """Returns the number of leaf nodes depth moves deep"""
+    moves = position.generate_legal_moves()
+    #The last level only needs the number of moves
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+def divide(position, depth):
+    """Returns the leaf node count below each legal move"""
+    counts = {}
+    for move in position.generate_legal_moves():
+        position.make_move(move)
+        counts[move_name(move)] = perft(position, depth - 1)
+        position.unmake_move()
+    return counts
+
+def timed_perft(position, depth):
+    """Returns the leaf node count and the seconds it took"""
+    start = time.perf_counter()
+    nodes = perft(position, depth)
+    return nodes, time.perf_counter() - start
+
+def report(name, nodes, seconds, expected = None):
+    """Prints a perft result line and returns true if it is correct"""
+    nps = nodes / seconds if seconds > 0 else 0
+    line = f'{name:<40} {nodes:>10} nodes {seconds:8.3f}s {nps:10.0f} nps'
+    correct = expected is None or nodes == expected
+    if expected is not None:
+        line += '  ok' if correct else f'  FAIL expected {expected}'
+    print(line)
+    return correct
+
+def run_suite(depth):
+    """Runs every reference position up to the depth, returns true if all
+    counts match"""
+    correct = True
+    for name, fen, counts in SUITE:
+        position = Position(fen)
+        for level in sorted(counts):
+            if level > depth:
+                break
+            nodes, seconds = timed_perft(position, level)
+            correct &= report(f'{name} depth {level}', nodes, seconds,
+                              counts[level])
+    for name, fen in INVALID:
+        try:
+            Position(fen)
+        except ValueError:
+            print(f'{name:<40} refused  ok')
+        else:
+            print(f'{name:<40} accepted  FAIL')
+            correct = False
+    return correct
+
+def main(argv = None):
+    """Runs perft from the command line, exits with 1 on a wrong count"""
+    parser = argparse.ArgumentParser(description = 'Move generator perft')
+    parser.add_argument('depth', type = int, nargs = '?', default = 3)
+    parser.add_argument('--fen', default = START_FEN)
+    parser.add_argument('--divide', action = 'store_true',
+                        help = 'show the node count below every move')
+    parser.add_argument('--suite', action = 'store_true',
+                        help = 'check the reference positions up to depth')
+    parser.add_argument('--expect', type = int,
+                        help = 'node count the run must produce')
+    parser.add_argument('--debug', action = 'store_true',
+                        help = 'check the incremental state after every move')
+    args = parser.parse_args(argv)
+    Position.debug = args.debug
+    if args.suite:
+        return 0 if run_suite(args.depth) else 1
+    position = Position(args.fen)
+    expected = args.expect
+    #Check the start position against its reference counts by default
+    if expected is None and args.fen == START_FEN:
+        expected = SUITE[0][2].get(args.depth)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(position, args.depth)
+        for name in sorted(counts):
+            print(f'{name}: {counts[name]}')
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(position, args.depth)
+    correct = report(f'perft {args.depth}', nodes,
+                     time.perf_counter() - start, expected)
+    return 0 if correct else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
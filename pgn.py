@@ -0,0 +1,319 @@
+"""Reads and writes games in PGN with moves in standard algebraic notation
+
+read_games streams the games of a file one at a time, so collections of any
+size are read in constant memory. Every move is checked against the rules of
+the Position and a move that cannot be played stops its game with a PGNError
+naming the game and ply. A move is found by looking back from its square
+for the pieces that can reach it and checking only their moves with
+Position.is_legal, but every move is still played with the attack maps kept
+up to date, so one process checks a few hundred games a second rather than
+thousands. Run this file to check collections, spread over a pool of
+processes one file at a time:
+
+    python pgn.py games.pgn
+    python pgn.py shard*.pgn --workers 8
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from position import (Position, START_FEN, WIDTH, HEIGHT, WHITE, EMPTY, PAWN,
+                      KNIGHT, BISHOP, ROOK, QUEEN, KING, CASTLES, FILES,
+                      PIECE_LETTERS, RAYS, KNIGHT_STEPS, KING_STEPS,
+                      ROOK_DIRS, BISHOP_DIRS, QUEEN_DIRS, make_piece,
+                      piece_type, square_name, parse_square)
+
+#Tags every exported game starts with, in order, with their unknown values
+SEVEN_TAGS = (('Event', '?'), ('Site', '?'), ('Date', '????.??.??'),
+              ('Round', '?'), ('White', '?'), ('Black', '?'), ('Result', '*'))
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+#Longest line of exported move text
+LINE_LENGTH = 79
+
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s*"((?:[^"\\]|\\.)*)"\s*\]')
+#Comments, variations, annotation glyphs, results and the words between them
+TOKEN_PATTERN = re.compile(
+    r'\{[^}]*\}?|;.*|\(|\)|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{};()$]+')
+SAN_PATTERN = re.compile(
+    r'^(?:([O0]-[O0](?:-[O0])?)|([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])'
+    r'(?:=?([NBRQ]))?)[+#]?[!?]*$')
+
+#Directions a sliding piece of each type moves along
+SLIDER_DIRS = {BISHOP: BISHOP_DIRS, ROOK: ROOK_DIRS, QUEEN: QUEEN_DIRS}
+
+class PGNError(ValueError):
+    """A move of a game that cannot be played"""
+    def __init__(self, game, ply, message):
+        super().__init__(f'game {game} ply {ply}: {message}')
+        self.game = game
+        self.ply = ply
+
+class Game:
+    """A game read from PGN: its tags, the moves that could be played, the
+    position after them, the result and the error that stopped it, if any"""
+    def __init__(self, number):
+        self.number = number
+        self.tags = {}
+        self.moves = []
+        self.position = None
+        self.result = '*'
+        self.error = None
+
+    def start(self):
+        """Sets up the position the moves are played from"""
+        try:
+            self.position = Position(self.tags.get('FEN'))
+        except ValueError as error:
+            self.position = Position()
+            self.fail(str(error))
+
+    def fail(self, message):
+        """Stops the game at the next ply"""
+        self.error = PGNError(self.number, len(self.moves) + 1, message)
+
+def parse_san(position, text):
+    """Returns the legal move written in SAN, raises ValueError when it does
+    not name exactly one"""
+    match = SAN_PATTERN.match(text)
+    if not match:
+        raise ValueError(f'invalid move {text!r}')
+    castle, letter, file, rank, target, promotion = match.groups()
+    us = position.turn
+    if castle:
+        #The long castle moves the king towards the a file
+        long = len(castle) > 3
+        candidates = [(entry[1], entry[2], EMPTY) for entry in CASTLES[us]
+                      if (entry[2] < entry[1]) == long]
+    else:
+        type = PIECE_LETTERS.index(letter.lower()) if letter else PAWN
+        end = parse_square(target)
+        if promotion:
+            promotion = PIECE_LETTERS.index(promotion.lower())
+        else:
+            promotion = EMPTY
+        board = position.board
+        if type == PAWN:
+            #Pawns without a capture stay on the file they move along
+            starts = range(FILES.index(file or target[0]), WIDTH*HEIGHT,
+                           WIDTH)
+        else:
+            starts = _reaching(board, type, end)
+            if file is not None:
+                starts = [start for start in starts
+                          if FILES[start % WIDTH] == file]
+        piece = make_piece(us, type)
+        candidates = [(start, end, promotion) for start in starts
+                      if board[start] == piece and
+                      (rank is None or str(HEIGHT - start // WIDTH) == rank)]
+    moves = [move for move in candidates if position.is_legal(move)]
+    if not moves:
+        raise ValueError(f'illegal move {text!r}')
+    if len(moves) > 1:
+        raise ValueError(f'ambiguous move {text!r}')
+    return moves[0]
+
+def _reaching(board, type, end):
+    """Returns the squares a piece of the type could reach a square from,
+    the first piece along each line for sliding pieces"""
+    if type == KNIGHT:
+        return KNIGHT_STEPS[end]
+    if type == KING:
+        return KING_STEPS[end]
+    starts = []
+    rays = RAYS[end]
+    for dir in SLIDER_DIRS[type]:
+        for start in rays[dir]:
+            if board[start]:
+                starts.append(start)
+                break
+    return starts
+
+def san(position, move, legal_moves = None):
+    """Returns the move written in SAN, it must be legal in the position"""
+    start, end, promotion = move
+    board = position.board
+    type = piece_type(board[start])
+    if type == KING and (end - start == 2 or end - start == -2):
+        text = 'O-O' if end > start else 'O-O-O'
+    elif type == PAWN:
+        text = square_name(end)
+        if start % WIDTH != end % WIDTH:
+            text = FILES[start % WIDTH] + 'x' + text
+        if promotion:
+            text += '=' + PIECE_LETTERS[promotion].upper()
+    else:
+        if legal_moves is None:
+            legal_moves = position.generate_legal_moves()
+        #Name the file, the rank or both when another piece could go there
+        others = [other[0] for other in legal_moves if other[1] == end and
+                  other[0] != start and board[other[0]] == board[start]]
+        prefix = ''
+        if others:
+            if all(other % WIDTH != start % WIDTH for other in others):
+                prefix = FILES[start % WIDTH]
+            elif all(other // WIDTH != start // WIDTH for other in others):
+                prefix = square_name(start)[1]
+            else:
+                prefix = square_name(start)
+        text = PIECE_LETTERS[type].upper() + prefix
+        if board[end]:
+            text += 'x'
+        text += square_name(end)
+    position.make_move(move)
+    if position.is_check():
+        text += '+' if position.generate_legal_moves() else '#'
+    position.unmake_move()
+    return text
+
+def read_games(lines, strict = False):
+    """Yields the games of PGN text one at a time, lines can be any iterable
+    of lines such as an open file. Games with a move that cannot be played
+    keep the moves before it and the error, strict raises the error
+    instead."""
+    game = None
+    number = 0
+    depth = 0
+    in_comment = False
+    for line in lines:
+        if in_comment:
+            close = line.find('}')
+            if close < 0:
+                continue
+            line = line[close+1:]
+            in_comment = False
+        if line.startswith('%'):
+            continue
+        stripped = line.strip()
+        if stripped.startswith('[') and not depth:
+            #Tags after move text start the next game
+            if game is not None and game.position is not None:
+                yield game
+                game = None
+            if game is None:
+                number += 1
+                game = Game(number)
+            match = TAG_PATTERN.match(stripped)
+            if match:
+                game.tags[match.group(1)] = (
+                    match.group(2).replace('\\"', '"').replace('\\\\', '\\'))
+            continue
+        for token in TOKEN_PATTERN.findall(line):
+            first = token[0]
+            if first == '{':
+                in_comment = not token.endswith('}')
+                continue
+            if first == '(':
+                depth += 1
+                continue
+            if first == ')':
+                depth = max(depth - 1, 0)
+                continue
+            if (depth or first == ';' or first == '$' or token[-1] == '.' or
+                token.isdigit()):
+                continue
+            if game is None:
+                number += 1
+                game = Game(number)
+            if game.position is None:
+                game.start()
+            if token in RESULTS:
+                game.result = token
+                yield game
+                game = None
+                continue
+            if game.error is not None:
+                continue
+            try:
+                move = parse_san(game.position, token)
+            except ValueError as error:
+                game.fail(str(error))
+                if strict:
+                    raise game.error
+                continue
+            game.position.make_move(move)
+            game.moves.append(move)
+    if game is not None:
+        yield game
+
+def write_game(moves, fen = START_FEN, tags = None, result = '*'):
+    """Returns the PGN of the moves played from a position, with the seven
+    tags every game needs followed by any others"""
+    tags = dict(tags or {})
+    tags['Result'] = result
+    if fen != START_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = fen
+    lines = []
+    for name, default in SEVEN_TAGS:
+        lines.append(_tag(name, tags.pop(name, default)))
+    for name, value in tags.items():
+        lines.append(_tag(name, value))
+    lines.append('')
+    position = Position(fen)
+    words = []
+    for ply, move in enumerate(moves):
+        if position.turn == WHITE:
+            words.append(f'{position.fullmove}.')
+        elif not ply:
+            words.append(f'{position.fullmove}...')
+        words.append(san(position, move))
+        position.make_move(move)
+    words.append(result)
+    line = ''
+    for word in words:
+        if line and len(line) + 1 + len(word) > LINE_LENGTH:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line else word
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+def _tag(name, value):
+    """Returns a tag line with the value escaped"""
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'[{name} "{value}"]'
+
+def check_file(path):
+    """Reads every game of a file and returns the number of games, plies and
+    the errors found"""
+    games = plies = 0
+    errors = []
+    with open(path, encoding = 'utf-8', errors = 'replace') as file:
+        for game in read_games(file):
+            games += 1
+            plies += len(game.moves)
+            if game.error is not None:
+                errors.append(f'{path}: {game.error}')
+    return games, plies, errors
+
+def main(argv = None):
+    """Checks PGN files from the command line, exits with 1 when a move
+    cannot be played"""
+    parser = argparse.ArgumentParser(description = 'Check PGN files')
+    parser.add_argument('files', nargs = '+')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(),
+                        help = 'processes to read the files in, 1 reads them '
+                               'in this process')
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    if args.workers > 1 and len(args.files) > 1:
+        with ProcessPoolExecutor(min(args.workers, len(args.files))) as pool:
+            results = list(pool.map(check_file, args.files))
+    else:
+        results = [check_file(path) for path in args.files]
+    seconds = max(time.perf_counter() - start, 1e-9)
+    games = sum(result[0] for result in results)
+    plies = sum(result[1] for result in results)
+    errors = [error for result in results for error in result[2]]
+    for error in errors:
+        print(error)
+    print(f'{games} games, {plies} plies in {seconds:.2f}s: '
+          f'{games / seconds:.0f} games/s, {plies / seconds:.0f} plies/s, '
+          f'{len(errors)} with errors')
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
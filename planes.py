@@ -0,0 +1,260 @@
+"""Encodes batches of positions as NumPy planes and finds the attacked
+squares and checks of every position of a batch at once
+
+A batch is an N x 70 array of positions packed as Position.pack does: the
+64 piece codes followed by the side to move, castling rights, en passant
+square and move counters. Batches are built from Position objects, such as
+the Side.position of a running game, from FEN strings or from packed bytes,
+and all the work on them is done by NumPy over the whole batch, so the
+Python cost is paid once per batch rather than once per piece.
+
+Planes are 8 x 8 with row 0 being the eighth rank, the same layout as the
+board of a Position. The 18 planes of a position are the white pawn,
+knight, bishop, rook, queen and king, the same six for black, a plane of
+ones when white is to move, one plane per castling right and the en
+passant square. Check the planes against the rules and time them with:
+
+    python planes.py 100000 --check
+"""
+import argparse
+import random
+import sys
+import time
+import numpy as np
+from position import (Position, WIDTH, HEIGHT, WHITE, BLACK, EMPTY, PAWN,
+                      KNIGHT, BISHOP, ROOK, QUEEN, KING, DIRECTIONS,
+                      ROOK_DIRS, KNIGHT_OFFSETS, CASTLES,
+                      CASTLE_LETTERS, FEN_SQUARES, make_piece, parse_square)
+
+SQUARES = WIDTH*HEIGHT
+PACKED_SIZE = SQUARES + 6
+#Columns of the packed state after the board
+TURN = SQUARES
+CASTLING = SQUARES + 1
+EP = SQUARES + 2
+#Planes of an encoded position
+PIECE_PLANES = 12
+TURN_PLANE = 12
+CASTLING_PLANES = 13
+EP_PLANE = 17
+PLANES = 18
+#Piece codes in the order of the piece planes
+PLANE_PIECES = np.array([make_piece(color, type) for color in (WHITE, BLACK)
+                         for type in range(PAWN, KING+1)], dtype = np.uint8)
+
+def pack_fen(fen):
+    """Returns a FEN string packed as Position.pack does, without setting
+    up the rest of a Position"""
+    fields = fen.split()
+    if not fields:
+        raise ValueError('empty FEN')
+    fields += ['w', '-', '-', '0', '1'][len(fields)-1:]
+    board = []
+    for letter in fields[0]:
+        if letter == '/':
+            continue
+        try:
+            board.extend(FEN_SQUARES[letter])
+        except KeyError:
+            raise ValueError(f'invalid piece {letter!r} in FEN') from None
+    if len(board) != SQUARES:
+        raise ValueError(f'FEN needs a full board: {fen!r}')
+    if fields[1] not in ('w', 'b'):
+        raise ValueError(f'invalid side to move {fields[1]!r}')
+    castling = 0
+    for letter, right in CASTLE_LETTERS:
+        if letter in fields[2]:
+            castling |= right
+    #Drop rights whose king or rook is not on its starting square
+    for color in (WHITE, BLACK):
+        for castle in CASTLES[color]:
+            if (board[castle[1]] != make_piece(color, KING) or
+                board[castle[3]] != make_piece(color, ROOK)):
+                castling &= ~castle[0]
+    ep = -1 if fields[3] == '-' else parse_square(fields[3])
+    return (bytes(board) +
+            bytes((WHITE if fields[1] == 'w' else BLACK, castling, ep + 1,
+                   min(int(fields[4]), 255))) +
+            int(fields[5]).to_bytes(2, 'little'))
+
+def pack_batch(positions):
+    """Returns an N x 70 array of positions given as Position objects, FEN
+    strings or packed bytes, an array is returned as it is"""
+    if isinstance(positions, np.ndarray):
+        return positions
+    data = bytearray()
+    for position in positions:
+        if isinstance(position, str):
+            data += pack_fen(position)
+        elif isinstance(position, (bytes, bytearray)):
+            data += position
+        else:
+            data += position.pack()
+    return np.frombuffer(bytes(data), dtype = np.uint8).reshape(-1,
+                                                                PACKED_SIZE)
+
+def encode(positions, dtype = np.float32):
+    """Returns the N x 18 x 8 x 8 planes of a batch of positions"""
+    batch = pack_batch(positions)
+    count = len(batch)
+    boards = batch[:, :SQUARES]
+    planes = np.zeros((count, PLANES, SQUARES), dtype = dtype)
+    planes[:, :PIECE_PLANES] = (boards[:, None, :] ==
+                                PLANE_PIECES[None, :, None])
+    planes[:, TURN_PLANE] = (batch[:, TURN] == WHITE)[:, None]
+    for plane, (letter, right) in enumerate(CASTLE_LETTERS):
+        planes[:, CASTLING_PLANES + plane] = (
+            (batch[:, CASTLING] & right) != 0)[:, None]
+    #The en passant square is stored one higher so 0 means none
+    passant = np.nonzero(batch[:, EP])[0]
+    planes[passant, EP_PLANE, batch[passant, EP].astype(np.intp) - 1] = 1
+    return planes.reshape(count, PLANES, HEIGHT, WIDTH)
+
+def _shift(masks, dx, dy):
+    """Returns N x 8 x 8 masks moved by a step, squares moved off the board
+    are dropped"""
+    shifted = np.zeros_like(masks)
+    shifted[:, max(dy, 0):HEIGHT + min(dy, 0),
+            max(dx, 0):WIDTH + min(dx, 0)] = (
+        masks[:, max(-dy, 0):HEIGHT + min(-dy, 0),
+              max(-dx, 0):WIDTH + min(-dx, 0)])
+    return shifted
+
+def attack_masks(positions, colors):
+    """Returns N x 8 x 8 masks of the squares attacked by a color in every
+    position of a batch, colors is one color or one per position"""
+    batch = pack_batch(positions)
+    boards = batch[:, :SQUARES].reshape(-1, HEIGHT, WIDTH)
+    colors = np.broadcast_to(np.asarray(colors, dtype = np.uint8),
+                             (len(batch),))
+    #Piece codes of the attacking color per position
+    offset = (colors << 3)[:, None, None]
+    def pieces(*types):
+        found = np.zeros(boards.shape, dtype = bool)
+        for type in types:
+            found |= boards == offset + type
+        return found
+    attacked = np.zeros(boards.shape, dtype = bool)
+    #Pawns take one row forward, up the board for white
+    pawns = pieces(PAWN)
+    white = (colors == WHITE)[:, None, None]
+    forward = np.where(white, _shift(pawns, 0, -1), _shift(pawns, 0, 1))
+    attacked |= _shift(forward, -1, 0) | _shift(forward, 1, 0)
+    knights = pieces(KNIGHT)
+    for dx, dy in KNIGHT_OFFSETS:
+        attacked |= _shift(knights, dx, dy)
+    king = pieces(KING)
+    for dx, dy in DIRECTIONS:
+        attacked |= _shift(king, dx, dy)
+    #Slide every ray one step at a time until it runs into a piece
+    empty = boards == EMPTY
+    straight = pieces(ROOK, QUEEN)
+    diagonal = pieces(BISHOP, QUEEN)
+    for dir, (dx, dy) in enumerate(DIRECTIONS):
+        ray = _shift(straight if dir in ROOK_DIRS else diagonal, dx, dy)
+        for _ in range(max(WIDTH, HEIGHT) - 2):
+            attacked |= ray
+            ray = _shift(ray & empty, dx, dy)
+            if not ray.any():
+                break
+        attacked |= ray
+    return attacked
+
+def in_check(positions):
+    """Returns an array of flags telling which positions of a batch have the
+    side to move in check"""
+    batch = pack_batch(positions)
+    turns = batch[:, TURN]
+    boards = batch[:, :SQUARES]
+    kings = boards == ((turns << 3) + KING)[:, None]
+    attacked = attack_masks(batch, turns ^ 1).reshape(-1, SQUARES)
+    return (kings & attacked).any(axis = 1)
+
+def random_positions(count, seed = 0, max_plies = 120):
+    """Returns positions reached by random games, for checks and timing"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = Position()
+        for _ in range(rng.randrange(max_plies)):
+            moves = position.generate_legal_moves()
+            if not moves:
+                break
+            position.make_move(rng.choice(moves))
+        positions.append(position)
+    return positions
+
+def check_batch(positions, batch):
+    """Returns the number of positions whose masks or check flags differ
+    from the rules of Position"""
+    errors = 0
+    checks = in_check(batch)
+    for color in (WHITE, BLACK):
+        masks = attack_masks(batch, color).reshape(-1, SQUARES)
+        for position, mask in zip(positions, masks):
+            expected = [count > 0 for count in position.attacks[color]]
+            if mask.tolist() != expected:
+                errors += 1
+    for position, check in zip(positions, checks):
+        if bool(check) != position.is_check():
+            errors += 1
+    planes = encode(batch[:100])
+    for position, plane in zip(positions, planes):
+        if position.pack()[:SQUARES + 3] != decode_board(plane):
+            errors += 1
+    return errors
+
+def decode_board(planes):
+    """Returns the board, side to move, castling and en passant bytes of
+    encoded planes, for checking encode"""
+    planes = planes.reshape(PLANES, SQUARES)
+    board = np.zeros(SQUARES, dtype = np.uint8)
+    for plane, piece in enumerate(PLANE_PIECES):
+        board[planes[plane] > 0] = piece
+    castling = 0
+    for plane, (letter, right) in enumerate(CASTLE_LETTERS):
+        if planes[CASTLING_PLANES + plane].any():
+            castling |= right
+    passant = np.nonzero(planes[EP_PLANE])[0]
+    ep = passant[0] + 1 if len(passant) else 0
+    turn = WHITE if planes[TURN_PLANE].any() else BLACK
+    return board.tobytes() + bytes((turn, castling, ep))
+
+def main(argv = None):
+    """Times the batch functions on random positions from the command line,
+    exits with 1 when they disagree with the rules"""
+    parser = argparse.ArgumentParser(description = 'Encode positions in bulk')
+    parser.add_argument('count', type = int, nargs = '?', default = 10000)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--check', action = 'store_true',
+                        help = 'compare the results with Position')
+    args = parser.parse_args(argv)
+    #Random games are slow to play, so a few are repeated to fill the batch
+    positions = random_positions(min(args.count, 2000), args.seed)
+    positions = (positions * (args.count // len(positions) + 1))[:args.count]
+    start = time.perf_counter()
+    batch = pack_batch(positions)
+    timings = [('pack', time.perf_counter() - start)]
+    fens = [position.fen() for position in positions[:10000]]
+    start = time.perf_counter()
+    pack_batch(fens)
+    timings.append(('pack FEN', (time.perf_counter() - start) *
+                    len(positions) / len(fens)))
+    for name, function in (('encode', lambda: encode(batch)),
+                           ('attack masks',
+                            lambda: attack_masks(batch, WHITE)),
+                           ('in check', lambda: in_check(batch))):
+        start = time.perf_counter()
+        function()
+        timings.append((name, time.perf_counter() - start))
+    for name, seconds in timings:
+        print(f'{name:<13} {seconds:8.3f}s {len(positions) / seconds:12.0f} '
+              f'positions/s')
+    if args.check:
+        errors = check_batch(positions[:2000], batch[:2000])
+        print(f'{errors} positions differ from the rules')
+        return 1 if errors else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1016 @@
+"""Headless chess rules shared by the pygame front end and batch tools"""
+import random
+
+#Board dimensions
+WIDTH = 8
+HEIGHT = 8
+
+#Colors, a piece code is its type with the color stored in the fourth bit
+WHITE = 0
+BLACK = 1
+
+#Piece types
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+
+#Names used by the sprites and image files
+TYPE_NAMES = {PAWN: 'pawn', KNIGHT: 'knight', BISHOP: 'bishop',
+              ROOK: 'rook', QUEEN: 'queen', KING: 'king'}
+NAME_TYPES = {name: type for type, name in TYPE_NAMES.items()}
+COLOR_NAMES = ('white', 'black')
+
+#Castling rights
+WHITE_SHORT = 1
+WHITE_LONG = 2
+BLACK_SHORT = 4
+BLACK_LONG = 8
+
+#Directions, orthogonal ones first then diagonal ones
+DIRECTIONS = ((1,0),(-1,0),(0,1),(0,-1),(1,1),(-1,-1),(1,-1),(-1,1))
+ROOK_DIRS = (0,1,2,3)
+BISHOP_DIRS = (4,5,6,7)
+QUEEN_DIRS = ROOK_DIRS + BISHOP_DIRS
+#Index of the direction pointing the other way
+OPPOSITE = (1,0,3,2,5,4,7,6)
+KNIGHT_OFFSETS = ((2,1),(2,-1),(-2,1),(-2,-1),(1,2),(1,-2),(-1,2),(-1,-2))
+
+#Back rank setup shared by both sides
+BACK_RANK = (ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK)
+
+#FEN of the start of a game and the letters used for the pieces
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+PIECE_LETTERS = ' pnbrqk'
+CASTLE_LETTERS = (('K', 1), ('Q', 2), ('k', 4), ('q', 8))
+FILES = 'abcdefgh'
+
+def square(x, y):
+    """Returns the square index of a coordinate"""
+    return y*WIDTH + x
+
+def coords(sq):
+    """Returns the coordinate of a square index"""
+    return (sq % WIDTH, sq // WIDTH)
+
+def make_piece(color, type):
+    """Returns the code of a piece"""
+    return type | (color << 3)
+
+def piece_color(piece):
+    """Returns the color of a piece code"""
+    return piece >> 3
+
+def piece_type(piece):
+    """Returns the type of a piece code"""
+    return piece & 7
+
+def square_name(sq):
+    """Returns the algebraic name of a square, such as e4"""
+    return FILES[sq % WIDTH] + str(HEIGHT - sq // WIDTH)
+
+def parse_square(name):
+    """Returns the square index of an algebraic square name"""
+    if (len(name) != 2 or name[0] not in FILES or 
+        name[1] not in '12345678'):
+        raise ValueError(f'invalid square {name!r}')
+    return square(FILES.index(name[0]), HEIGHT - int(name[1]))
+
+def move_name(move):
+    """Returns the coordinate notation of a move, such as e2e4 or e7e8q"""
+    start, end, promotion = move
+    name = square_name(start) + square_name(end)
+    if promotion:
+        name += PIECE_LETTERS[promotion]
+    return name
+
+def parse_move(name):
+    """Returns the move of a coordinate notation name, such as e2e4 or
+    e7e8q"""
+    if len(name) not in (4, 5) or (len(name) == 5 and
+                                   name[4] not in PIECE_LETTERS[KNIGHT:KING]):
+        raise ValueError(f'invalid move {name!r}')
+    promotion = PIECE_LETTERS.index(name[4]) if len(name) == 5 else EMPTY
+    return (parse_square(name[:2]), parse_square(name[2:4]), promotion)
+
+def _build_rays():
+    """Returns the squares along every direction from every square"""
+    rays = []
+    for sq in range(WIDTH*HEIGHT):
+        x,y = coords(sq)
+        sq_rays = []
+        for dx,dy in DIRECTIONS:
+            ray = []
+            nx, ny = x+dx, y+dy
+            while 0 <= nx < WIDTH and 0 <= ny < HEIGHT:
+                ray.append(square(nx,ny))
+                nx += dx
+                ny += dy
+            sq_rays.append(tuple(ray))
+        rays.append(tuple(sq_rays))
+    return tuple(rays)
+
+def _build_steps(offsets):
+    """Returns the squares a single step away along the offsets"""
+    steps = []
+    for sq in range(WIDTH*HEIGHT):
+        x,y = coords(sq)
+        steps.append(tuple(square(x+dx,y+dy) for dx,dy in offsets
+                           if 0 <= x+dx < WIDTH and 0 <= y+dy < HEIGHT))
+    return tuple(steps)
+
+RAYS = _build_rays()
+KNIGHT_STEPS = _build_steps(KNIGHT_OFFSETS)
+KING_STEPS = _build_steps(DIRECTIONS)
+#Squares a pawn of each color attacks from every square
+PAWN_ATTACKS = (_build_steps(((-1,-1),(1,-1))), _build_steps(((-1,1),(1,1))))
+
+#Castling details per color, (right, king start, king end, rook start,
+#rook end, squares that must be empty, squares that must not be attacked)
+CASTLES = (
+    ((WHITE_SHORT, 60, 62, 63, 61, (61,62), (60,61,62)),
+     (WHITE_LONG, 60, 58, 56, 59, (57,58,59), (60,59,58))),
+    ((BLACK_SHORT, 4, 6, 7, 5, (5,6), (4,5,6)),
+     (BLACK_LONG, 4, 2, 0, 3, (1,2,3), (4,3,2))))
+#Castling rights lost when a piece leaves or arrives on a square
+CASTLE_MASK = [15]*(WIDTH*HEIGHT)
+CASTLE_MASK[60] = 15 & ~(WHITE_SHORT | WHITE_LONG)
+CASTLE_MASK[63] = 15 & ~WHITE_SHORT
+CASTLE_MASK[56] = 15 & ~WHITE_LONG
+CASTLE_MASK[4] = 15 & ~(BLACK_SHORT | BLACK_LONG)
+CASTLE_MASK[7] = 15 & ~BLACK_SHORT
+CASTLE_MASK[0] = 15 & ~BLACK_LONG
+CASTLE_MASK = tuple(CASTLE_MASK)
+
+#Pieces a pawn can promote into
+PROMOTIONS = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+def _build_fen_squares():
+    """Returns the squares filled by every character of a FEN board, so a
+    row is parsed with one lookup per character"""
+    squares = {str(count): [EMPTY]*count for count in range(1, WIDTH+1)}
+    for type in range(PAWN, KING+1):
+        letter = PIECE_LETTERS[type]
+        squares[letter.upper()] = [make_piece(WHITE, type)]
+        squares[letter] = [make_piece(BLACK, type)]
+    return squares
+
+FEN_SQUARES = _build_fen_squares()
+FEN_LETTERS = {pieces[0]: letter for letter, pieces in FEN_SQUARES.items()
+               if pieces[0] != EMPTY}
+
+#Bytes of a position stored by Position.compress: two squares per byte,
+#then the side to move and castling rights, en passant square and counters
+COMPACT_SIZE = WIDTH*HEIGHT//2 + 5
+#The two piece codes held by every byte of a compressed board
+NIBBLES = tuple((byte >> 4, byte & 15) for byte in range(256))
+
+#Sliding piece types that move along each direction
+SLIDERS = tuple((ROOK, QUEEN) if dir in ROOK_DIRS else (BISHOP, QUEEN)
+                for dir in range(len(DIRECTIONS)))
+
+def _build_zobrist():
+    """Returns the random keys hashed into positions, seeded so every
+    process builds the same ones"""
+    generator = random.Random(20210917)
+    pieces = tuple(tuple(generator.getrandbits(64) 
+                         for sq in range(WIDTH*HEIGHT)) for piece in range(16))
+    turn = generator.getrandbits(64)
+    castling = tuple(generator.getrandbits(64) for rights in range(16))
+    ep = tuple(generator.getrandbits(64) for file in range(WIDTH))
+    return pieces, turn, castling, ep
+
+#Zobrist keys per piece code and square, for black to move, per set of
+#castling rights and per en passant file
+ZOBRIST_PIECES, ZOBRIST_TURN, ZOBRIST_CASTLING, ZOBRIST_EP = _build_zobrist()
+
+#Piece values in centipawns
+VALUES = (0, 100, 320, 330, 500, 900, 0)
+
+#Piece square tables as seen by white, from the top left of the board
+PAWN_TABLE = (
+     0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+     5,  5, 10, 25, 25, 10,  5,  5,
+     0,  0,  0, 20, 20,  0,  0,  0,
+     5, -5,-10,  0,  0,-10, -5,  5,
+     5, 10, 10,-20,-20, 10, 10,  5,
+     0,  0,  0,  0,  0,  0,  0,  0)
+KNIGHT_TABLE = (
+   -50,-40,-30,-30,-30,-30,-40,-50,
+   -40,-20,  0,  0,  0,  0,-20,-40,
+   -30,  0, 10, 15, 15, 10,  0,-30,
+   -30,  5, 15, 20, 20, 15,  5,-30,
+   -30,  0, 15, 20, 20, 15,  0,-30,
+   -30,  5, 10, 15, 15, 10,  5,-30,
+   -40,-20,  0,  5,  5,  0,-20,-40,
+   -50,-40,-30,-30,-30,-30,-40,-50)
+BISHOP_TABLE = (
+   -20,-10,-10,-10,-10,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5, 10, 10,  5,  0,-10,
+   -10,  5,  5, 10, 10,  5,  5,-10,
+   -10,  0, 10, 10, 10, 10,  0,-10,
+   -10, 10, 10, 10, 10, 10, 10,-10,
+   -10,  5,  0,  0,  0,  0,  5,-10,
+   -20,-10,-10,-10,-10,-10,-10,-20)
+ROOK_TABLE = (
+     0,  0,  0,  0,  0,  0,  0,  0,
+     5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+     0,  0,  0,  5,  5,  0,  0,  0)
+QUEEN_TABLE = (
+   -20,-10,-10, -5, -5,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5,  5,  5,  5,  0,-10,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+     0,  0,  5,  5,  5,  5,  0, -5,
+   -10,  5,  5,  5,  5,  5,  0,-10,
+   -10,  0,  5,  0,  0,  0,  0,-10,
+   -20,-10,-10, -5, -5,-10,-10,-20)
+KING_TABLE = (
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -20,-30,-30,-40,-40,-30,-30,-20,
+   -10,-20,-20,-20,-20,-20,-20,-10,
+    20, 20,  0,  0,  0,  0, 20, 20,
+    20, 30, 10,  0,  0, 10, 30, 20)
+#Endgame tables for the pieces that play differently once the queens and
+#most pieces are gone: pawns race to promote and the king comes forward
+PAWN_END_TABLE = (
+     0,  0,  0,  0,  0,  0,  0,  0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    20, 20, 20, 20, 20, 20, 20, 20,
+    10, 10, 10, 10, 10, 10, 10, 10,
+     0,  0,  0,  0,  0,  0,  0,  0,
+     0,  0,  0,  0,  0,  0,  0,  0)
+KING_END_TABLE = (
+   -50,-40,-30,-20,-20,-30,-40,-50,
+   -30,-20,-10,  0,  0,-10,-20,-30,
+   -30,-10, 20, 30, 30, 20,-10,-30,
+   -30,-10, 30, 40, 40, 30,-10,-30,
+   -30,-10, 30, 40, 40, 30,-10,-30,
+   -30,-10, 20, 30, 30, 20,-10,-30,
+   -30,-30,  0,  0,  0,  0,-30,-30,
+   -50,-30,-30,-30,-30,-30,-30,-50)
+MIDDLEGAME_TABLES = (None, PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE,
+                     QUEEN_TABLE, KING_TABLE)
+ENDGAME_TABLES = (None, PAWN_END_TABLE, KNIGHT_TABLE, BISHOP_TABLE,
+                  ROOK_TABLE, QUEEN_TABLE, KING_END_TABLE)
+#Weight of every piece type in the game phase, which is PHASE_TOTAL with
+#all the pieces on the board and falls towards 0 in the endgame
+PHASE_WEIGHTS = (0, 0, 1, 1, 2, 4, 0)
+PHASE_TOTAL = 24
+
+def _build_scores(tables):
+    """Returns the value of every piece code on every square, material
+    included, positive for white and negative for black"""
+    scores = [(0,)*(WIDTH*HEIGHT)]*16
+    for type in range(PAWN, KING+1):
+        #Mirror the square vertically for black
+        scores[make_piece(WHITE, type)] = tuple(
+            VALUES[type] + tables[type][sq] for sq in range(WIDTH*HEIGHT))
+        scores[make_piece(BLACK, type)] = tuple(
+            -VALUES[type] - tables[type][sq ^ 56]
+            for sq in range(WIDTH*HEIGHT))
+    return tuple(scores)
+
+#Middlegame and endgame scores and phase weight per piece code and square
+MIDDLEGAME_SCORES = _build_scores(MIDDLEGAME_TABLES)
+ENDGAME_SCORES = _build_scores(ENDGAME_TABLES)
+PHASES = tuple(PHASE_WEIGHTS[piece & 7] if piece & 7 <= KING else 0
+               for piece in range(16))
+
+class Position:
+    """A chess position with the rules to generate and make moves
+
+    Squares are indexes from 0 to 63 counted from the top left of the board
+    as seen by white, matching the (x, y) coordinates of the front end.
+    Moves are (start, end, promotion) tuples where promotion is a piece type
+    or EMPTY.
+
+    The attacks lists hold, per color, how many pieces attack every square.
+    They are kept up to date as pieces are placed and removed by only
+    walking the rays of the sliding pieces that pass through the changed
+    squares.
+
+    The key is a 64 bit Zobrist hash of the position updated with every
+    move, and repetitions counts how often each key has been reached in
+    the game so repetitions can be found without searching the history.
+
+    The middlegame and endgame scores and the game phase are updated the
+    same way as the key, so evaluate blends them without looking at the
+    board.
+
+    Positions have slots instead of a dict of attributes. Positions that
+    only have to be kept rather than played from are stored in a
+    PositionStore, in 37 bytes each."""
+
+    __slots__ = ('board', 'turn', 'castling', 'ep', 'halfmove', 'fullmove',
+                 'kings', 'history', 'attacks', 'key', 'repetitions',
+                 'middlegame', 'endgame', 'phase')
+    #Check the incremental state against a full recompute after every move
+    debug = False
+    def __init__(self, fen = None):
+        """Initiates the position to the start of a game, or to the position
+        described by a FEN string"""
+        if fen is None:
+            self.reset()
+        else:
+            self.set_fen(fen)
+
+    def reset(self):
+        """Sets up the pieces at the start of a game"""
+        self.board = [EMPTY]*(WIDTH*HEIGHT)
+        for x in range(WIDTH):
+            self.board[square(x,0)] = make_piece(BLACK, BACK_RANK[x])
+            self.board[square(x,1)] = make_piece(BLACK, PAWN)
+            self.board[square(x,6)] = make_piece(WHITE, PAWN)
+            self.board[square(x,7)] = make_piece(WHITE, BACK_RANK[x])
+        self.turn = WHITE
+        self.castling = WHITE_SHORT | WHITE_LONG | BLACK_SHORT | BLACK_LONG
+        self.ep = -1
+        self.halfmove = 0
+        self.fullmove = 1
+        self.kings = [square(4,7), square(4,0)]
+        self._setup_state()
+
+    def set_fen(self, fen):
+        """Sets up the position described by a FEN string"""
+        fields = fen.split()
+        if not fields:
+            raise ValueError('empty FEN')
+        fields += ['w', '-', '-', '0', '1'][len(fields)-1:]
+        rows = fields[0].split('/')
+        if len(rows) != HEIGHT:
+            raise ValueError(f'FEN needs {HEIGHT} rows: {fen!r}')
+        board = []
+        for row in rows:
+            for letter in row:
+                try:
+                    board.extend(FEN_SQUARES[letter])
+                except KeyError:
+                    raise ValueError(f'invalid piece {letter!r} in FEN') from None
+            if len(board) % WIDTH:
+                raise ValueError(f'FEN row {row!r} is not {WIDTH} squares')
+        try:
+            kings = [board.index(make_piece(WHITE, KING)),
+                     board.index(make_piece(BLACK, KING))]
+        except ValueError:
+            kings = None
+        if len(board) != WIDTH*HEIGHT or kings is None:
+            raise ValueError(f'FEN needs a full board with both kings: '
+                             f'{fen!r}')
+        if fields[1] not in ('w', 'b'):
+            raise ValueError(f'invalid side to move {fields[1]!r}')
+        self.board = board
+        self.kings = kings
+        self.turn = WHITE if fields[1] == 'w' else BLACK
+        self.castling = 0
+        for letter, right in CASTLE_LETTERS:
+            if letter in fields[2]:
+                self.castling |= right
+        #Drop rights whose king or rook is not on its starting square
+        for color in (WHITE, BLACK):
+            for castle in CASTLES[color]:
+                if (board[castle[1]] != make_piece(color, KING) or 
+                    board[castle[3]] != make_piece(color, ROOK)):
+                    self.castling &= ~castle[0]
+        self.ep = -1
+        if fields[3] != '-':
+            ep = parse_square(fields[3])
+            #The pawn that stepped twice stands right behind the square
+            if self.turn == WHITE:
+                row, behind = 2, ep + WIDTH
+            else:
+                row, behind = 5, ep - WIDTH
+            if (ep // WIDTH != row or board[ep] != EMPTY or
+                board[behind] != make_piece(self.turn ^ 1, PAWN)):
+                raise ValueError(f'impossible en passant square '
+                                 f'{fields[3]!r}')
+            self.ep = ep
+        self.halfmove = int(fields[4])
+        self.fullmove = int(fields[5])
+        self._setup_state()
+
+    def fen(self):
+        """Returns the FEN string describing the position"""
+        rows = []
+        for y in range(HEIGHT):
+            row = ''
+            empty = 0
+            for piece in self.board[y*WIDTH:(y+1)*WIDTH]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += FEN_LETTERS[piece]
+            rows.append(row + str(empty) if empty else row)
+        castling = ''.join(letter for letter, right in CASTLE_LETTERS
+                           if self.castling & right) or '-'
+        ep = square_name(self.ep) if self.ep >= 0 else '-'
+        return (f'{"/".join(rows)} {"wb"[self.turn]} {castling} {ep} '
+                f'{self.halfmove} {self.fullmove}')
+
+    def copy(self):
+        """Returns an independent copy of the position and its history"""
+        other = Position.__new__(Position)
+        other.board = self.board[:]
+        other.turn = self.turn
+        other.castling = self.castling
+        other.ep = self.ep
+        other.halfmove = self.halfmove
+        other.fullmove = self.fullmove
+        other.kings = self.kings[:]
+        other.history = self.history[:]
+        other.attacks = [self.attacks[WHITE][:], self.attacks[BLACK][:]]
+        other.key = self.key
+        other.middlegame = self.middlegame
+        other.endgame = self.endgame
+        other.phase = self.phase
+        other.repetitions = self.repetitions.copy()
+        return other
+
+    def pack(self):
+        """Returns the position as 70 bytes, the board followed by the side
+        to move, castling rights, en passant square and move counters, for
+        sending to other processes. The history is left out."""
+        return (bytes(self.board) + 
+                bytes((self.turn, self.castling, self.ep + 1, 
+                       min(self.halfmove, 255))) + 
+                self.fullmove.to_bytes(2, 'little'))
+
+    @classmethod
+    def unpack(cls, data):
+        """Returns the position stored by pack"""
+        turn, castling, ep, halfmove = data[WIDTH*HEIGHT:WIDTH*HEIGHT+4]
+        fullmove = int.from_bytes(data[WIDTH*HEIGHT+4:], 'little')
+        return cls._from_fields(list(data[:WIDTH*HEIGHT]), turn, castling,
+                                ep - 1, halfmove, fullmove)
+
+    def compress(self):
+        """Returns the position as COMPACT_SIZE bytes, the board packed two
+        squares to a byte, for keeping many positions in memory. The
+        history is left out."""
+        board = self.board
+        return (bytes((board[sq] << 4) | board[sq+1]
+                      for sq in range(0, WIDTH*HEIGHT, 2)) +
+                bytes((self.turn | self.castling << 1, self.ep + 1,
+                       min(self.halfmove, 255))) +
+                self.fullmove.to_bytes(2, 'little'))
+
+    @classmethod
+    def decompress(cls, data):
+        """Returns the position stored by compress"""
+        board = []
+        for byte in data[:WIDTH*HEIGHT//2]:
+            board += NIBBLES[byte]
+        state, ep, halfmove = data[WIDTH*HEIGHT//2:WIDTH*HEIGHT//2+3]
+        fullmove = int.from_bytes(data[WIDTH*HEIGHT//2+3:], 'little')
+        return cls._from_fields(board, state & 1, state >> 1, ep - 1,
+                                halfmove, fullmove)
+
+    @classmethod
+    def _from_fields(cls, board, turn, castling, ep, halfmove, fullmove):
+        """Returns the position with the board and state read back from
+        bytes"""
+        position = cls.__new__(cls)
+        position.board = board
+        position.turn = turn
+        position.castling = castling
+        position.ep = ep
+        position.halfmove = halfmove
+        position.fullmove = fullmove
+        position.kings = [board.index(make_piece(WHITE, KING)),
+                          board.index(make_piece(BLACK, KING))]
+        position._setup_state()
+        return position
+
+    def _setup_state(self):
+        """Builds the state tracked incrementally once the pieces are set"""
+        self.history = []
+        self.attacks = self.compute_attacks()
+        self.key = self.compute_key()
+        self.repetitions = {self.key: 1}
+        self.middlegame, self.endgame, self.phase = self.compute_evaluation()
+
+    def _ep_key(self):
+        """Returns the key of the en passant square, only hashed when a pawn
+        of the side to move could take en passant"""
+        if self.ep < 0:
+            return 0
+        pawn = make_piece(self.turn, PAWN)
+        for source in PAWN_ATTACKS[self.turn ^ 1][self.ep]:
+            if self.board[source] == pawn:
+                return ZOBRIST_EP[self.ep % WIDTH]
+        return 0
+
+    def compute_key(self):
+        """Returns the Zobrist key of the position built from scratch"""
+        key = ZOBRIST_CASTLING[self.castling] ^ self._ep_key()
+        if self.turn == BLACK:
+            key ^= ZOBRIST_TURN
+        for sq in range(WIDTH*HEIGHT):
+            if self.board[sq]:
+                key ^= ZOBRIST_PIECES[self.board[sq]][sq]
+        return key
+
+    def check_state(self):
+        """Raises an error if the incremental state differs from a full
+        recompute"""
+        if self.key != self.compute_key():
+            raise RuntimeError('Zobrist key is out of step with the board')
+        if self.attacks != self.compute_attacks():
+            raise RuntimeError('attack maps are out of step with the board')
+        if (self.middlegame, self.endgame, self.phase) != (
+            self.compute_evaluation()):
+            raise RuntimeError('evaluation is out of step with the board')
+
+    def compute_evaluation(self):
+        """Returns the middlegame score, endgame score and game phase built
+        from scratch"""
+        middlegame = endgame = phase = 0
+        for sq in range(WIDTH*HEIGHT):
+            piece = self.board[sq]
+            if piece:
+                middlegame += MIDDLEGAME_SCORES[piece][sq]
+                endgame += ENDGAME_SCORES[piece][sq]
+                phase += PHASES[piece]
+        return middlegame, endgame, phase
+
+    def evaluate(self):
+        """Returns the static score of the position for the side to move,
+        the middlegame and endgame scores blended by the game phase"""
+        phase = min(self.phase, PHASE_TOTAL)
+        score = ((self.middlegame*phase + self.endgame*(PHASE_TOTAL - phase))
+                 // PHASE_TOTAL)
+        return score if self.turn == WHITE else -score
+
+    def is_repetition(self, count = 3):
+        """Returns true if the position has been reached count times"""
+        return self.repetitions.get(self.key, 0) >= count
+
+    def compute_attacks(self):
+        """Returns the attack counts of both colors built from scratch"""
+        attacks = [[0]*(WIDTH*HEIGHT), [0]*(WIDTH*HEIGHT)]
+        for sq in range(WIDTH*HEIGHT):
+            piece = self.board[sq]
+            if piece:
+                color_attacks = attacks[piece_color(piece)]
+                for target in self.attacks_from(sq):
+                    color_attacks[target] += 1
+        return attacks
+
+    def _shift_rays(self, sq, change):
+        """Extends or blocks the rays of the sliding pieces passing through
+        a square that is being emptied or filled"""
+        board = self.board
+        rays = RAYS[sq]
+        for dir in range(8):
+            #Find the first piece behind the square along this direction
+            for source in rays[OPPOSITE[dir]]:
+                piece = board[source]
+                if piece:
+                    if piece_type(piece) in SLIDERS[dir]:
+                        color_attacks = self.attacks[piece_color(piece)]
+                        for target in rays[dir]:
+                            color_attacks[target] += change
+                            if board[target]:
+                                break
+                    break
+
+    def _add_attacks(self, sq, change):
+        """Adds or removes the attacks of the piece on a square"""
+        color_attacks = self.attacks[piece_color(self.board[sq])]
+        for target in self.attacks_from(sq):
+            color_attacks[target] += change
+
+    def _place(self, sq, piece):
+        """Puts a piece on an empty square"""
+        self._shift_rays(sq, -1)
+        self.board[sq] = piece
+        self._add_attacks(sq, 1)
+        self.key ^= ZOBRIST_PIECES[piece][sq]
+        self.middlegame += MIDDLEGAME_SCORES[piece][sq]
+        self.endgame += ENDGAME_SCORES[piece][sq]
+        self.phase += PHASES[piece]
+
+    def _remove(self, sq):
+        """Takes the piece off a square"""
+        piece = self.board[sq]
+        self.key ^= ZOBRIST_PIECES[piece][sq]
+        self.middlegame -= MIDDLEGAME_SCORES[piece][sq]
+        self.endgame -= ENDGAME_SCORES[piece][sq]
+        self.phase -= PHASES[piece]
+        self._add_attacks(sq, -1)
+        self.board[sq] = EMPTY
+        self._shift_rays(sq, 1)
+
+    def _replace(self, sq, piece):
+        """Swaps the piece on an occupied square for another one"""
+        old = self.board[sq]
+        self.key ^= ZOBRIST_PIECES[old][sq] ^ ZOBRIST_PIECES[piece][sq]
+        self.middlegame += (MIDDLEGAME_SCORES[piece][sq] -
+                            MIDDLEGAME_SCORES[old][sq])
+        self.endgame += ENDGAME_SCORES[piece][sq] - ENDGAME_SCORES[old][sq]
+        self.phase += PHASES[piece] - PHASES[old]
+        self._add_attacks(sq, -1)
+        self.board[sq] = piece
+        self._add_attacks(sq, 1)
+
+    def is_attacked(self, sq, color):
+        """Returns true if the square is attacked by a piece of the color"""
+        return self.attacks[color][sq] > 0
+
+    def is_check(self, color = None):
+        """Returns true if the color, by default the side to move, is in
+        check"""
+        if color is None:
+            color = self.turn
+        return self.is_attacked(self.kings[color], color ^ 1)
+
+    def attacks_from(self, sq):
+        """Returns the squares the piece on a square puts pressure on"""
+        board = self.board
+        piece = board[sq]
+        type = piece_type(piece)
+        if type == PAWN:
+            return list(PAWN_ATTACKS[piece_color(piece)][sq])
+        if type == KNIGHT:
+            return list(KNIGHT_STEPS[sq])
+        if type == KING:
+            return list(KING_STEPS[sq])
+        if type == ROOK:
+            dirs = ROOK_DIRS
+        elif type == BISHOP:
+            dirs = BISHOP_DIRS
+        elif type == QUEEN:
+            dirs = QUEEN_DIRS
+        else:
+            return []
+        pressure = []
+        rays = RAYS[sq]
+        for dir in dirs:
+            for target in rays[dir]:
+                pressure.append(target)
+                if board[target]:
+                    break
+        return pressure
+
+    def piece_moves(self, sq, moves):
+        """Adds the moves of the piece on a square to the list, ignoring
+        check"""
+        board = self.board
+        piece = board[sq]
+        color = piece_color(piece)
+        type = piece_type(piece)
+        if type == PAWN:
+            self._pawn_moves(sq, color, moves)
+            return moves
+        if type == KNIGHT or type == KING:
+            steps = KNIGHT_STEPS[sq] if type == KNIGHT else KING_STEPS[sq]
+            for target in steps:
+                other = board[target]
+                if not other or piece_color(other) != color:
+                    moves.append((sq, target, EMPTY))
+            if type == KING:
+                self._castle_moves(color, moves)
+            return moves
+        if type == ROOK:
+            dirs = ROOK_DIRS
+        elif type == BISHOP:
+            dirs = BISHOP_DIRS
+        else:
+            dirs = QUEEN_DIRS
+        rays = RAYS[sq]
+        for dir in dirs:
+            for target in rays[dir]:
+                other = board[target]
+                if other:
+                    if piece_color(other) != color:
+                        moves.append((sq, target, EMPTY))
+                    break
+                moves.append((sq, target, EMPTY))
+        return moves
+
+    def _pawn_moves(self, sq, color, moves):
+        """Adds the pushes, captures and en passant moves of a pawn"""
+        board = self.board
+        if color == WHITE:
+            forward, start_row, last_row = -WIDTH, 6, 0
+        else:
+            forward, start_row, last_row = WIDTH, 1, 7
+        targets = []
+        #Pushes one and two spaces ahead
+        ahead = sq + forward
+        if not board[ahead]:
+            targets.append(ahead)
+            if sq // WIDTH == start_row and not board[ahead + forward]:
+                targets.append(ahead + forward)
+        #Diagonal captures and en passant
+        for target in PAWN_ATTACKS[color][sq]:
+            other = board[target]
+            if (other and piece_color(other) != color) or target == self.ep:
+                targets.append(target)
+        for target in targets:
+            if target // WIDTH == last_row:
+                for promotion in PROMOTIONS:
+                    moves.append((sq, target, promotion))
+            else:
+                moves.append((sq, target, EMPTY))
+
+    def _castle_moves(self, color, moves):
+        """Adds the castling moves available to the color"""
+        board = self.board
+        for (right, king_start, king_end, rook_start, rook_end, empty,
+             safe) in CASTLES[color]:
+            if not self.castling & right:
+                continue
+            if any(board[target] for target in empty):
+                continue
+            if any(self.is_attacked(target, color ^ 1) for target in safe):
+                continue
+            moves.append((king_start, king_end, EMPTY))
+
+    def generate_pseudo_moves(self):
+        """Returns the moves of the side to move, ignoring check"""
+        moves = []
+        board = self.board
+        turn = self.turn
+        for sq in range(WIDTH*HEIGHT):
+            piece = board[sq]
+            if piece and piece_color(piece) == turn:
+                self.piece_moves(sq, moves)
+        return moves
+
+    def checks_and_pins(self):
+        """Returns the pieces giving check to the side to move as (square,
+        squares that stop the check, direction) tuples, and the pinned
+        pieces as a dict of square to the squares they may still move to"""
+        board = self.board
+        us = self.turn
+        them = us ^ 1
+        king = self.kings[us]
+        checkers = []
+        pins = {}
+        #Checks from the pieces that step
+        if self.attacks[them][king]:
+            knight = make_piece(them, KNIGHT)
+            for source in KNIGHT_STEPS[king]:
+                if board[source] == knight:
+                    checkers.append((source, (source,), -1))
+            pawn = make_piece(them, PAWN)
+            for source in PAWN_ATTACKS[us][king]:
+                if board[source] == pawn:
+                    checkers.append((source, (source,), -1))
+        #Checks and pins along the rays from the king
+        rays = RAYS[king]
+        for dir in range(8):
+            line = []
+            pinned = -1
+            for target in rays[dir]:
+                line.append(target)
+                piece = board[target]
+                if not piece:
+                    continue
+                if piece_color(piece) == us:
+                    if pinned >= 0:
+                        break
+                    pinned = target
+                    continue
+                if piece_type(piece) in SLIDERS[dir]:
+                    if pinned >= 0:
+                        pins[pinned] = line
+                    else:
+                        checkers.append((target, line, dir))
+                break
+        return checkers, pins
+
+    def generate_legal_moves(self):
+        """Returns the legal moves of the side to move
+
+        Moves are only emitted when legal, pinned pieces stay on their pin
+        ray, in check only blocks and captures are kept, and the king avoids
+        attacked squares. En passant is still tested by playing it."""
+        board = self.board
+        us = self.turn
+        them = us ^ 1
+        king = self.kings[us]
+        enemy_attacks = self.attacks[them]
+        checkers, pins = self.checks_and_pins()
+        legal = []
+        #The king cannot step onto attacked squares or back along the ray
+        #of a sliding piece that gives check
+        behind = [RAYS[king][OPPOSITE[dir]][0] for _, _, dir in checkers
+                  if dir >= 0 and RAYS[king][OPPOSITE[dir]]]
+        for target in KING_STEPS[king]:
+            other = board[target]
+            if ((not other or piece_color(other) == them) and
+                not enemy_attacks[target] and target not in behind):
+                legal.append((king, target, EMPTY))
+        #Only the king can move out of a double check
+        if len(checkers) > 1:
+            return legal
+        if checkers:
+            block = checkers[0][1]
+        else:
+            block = None
+            self._castle_moves(us, legal)
+        for sq in range(WIDTH*HEIGHT):
+            piece = board[sq]
+            if (not piece or piece_color(piece) != us or 
+                piece_type(piece) == KING):
+                continue
+            pin = pins.get(sq)
+            for move in self.piece_moves(sq, []):
+                end = move[1]
+                if end == self.ep and piece_type(piece) == PAWN:
+                    #En passant can expose the king along the rank
+                    self.make_move(move)
+                    if not self.attacks[them][king]:
+                        legal.append(move)
+                    self.unmake_move()
+                    continue
+                if pin is not None and end not in pin:
+                    continue
+                if block is not None and end not in block:
+                    continue
+                legal.append(move)
+        return legal
+
+    def is_legal(self, move):
+        """Returns true if the move is legal, only looking at the moving
+        piece instead of generating every move"""
+        start, end, promotion = move
+        piece = self.board[start]
+        if (not piece or piece_color(piece) != self.turn or
+            move not in self.piece_moves(start, [])):
+            return False
+        type = piece_type(piece)
+        #Castling already checked the squares the king crosses
+        if type == KING and (end - start == 2 or end - start == -2):
+            return True
+        if type == PAWN and end == self.ep:
+            us = self.turn
+            self.make_move(move)
+            legal = not self.attacks[us ^ 1][self.kings[us]]
+            self.unmake_move()
+            return legal
+        checkers, pins = self.checks_and_pins()
+        #The king cannot step onto an attacked square or back along the ray
+        #of a sliding piece that gives check
+        if type == KING:
+            if self.attacks[self.turn ^ 1][end]:
+                return False
+            return not any(dir >= 0 and end in RAYS[start][OPPOSITE[dir]][:1]
+                           for _, _, dir in checkers)
+        if start in pins and end not in pins[start]:
+            return False
+        if len(checkers) > 1:
+            return False
+        return not checkers or end in checkers[0][1]
+
+    def make_move(self, move):
+        """Plays a move, which is assumed to be legal"""
+        start, end, promotion = move
+        board = self.board
+        piece = board[start]
+        type = piece_type(piece)
+        color = self.turn
+        captured = board[end]
+        capture_sq = end
+        key = self.key
+        self.key ^= ZOBRIST_CASTLING[self.castling] ^ self._ep_key()
+        self._remove(start)
+        #En passant removes the pawn behind the end square
+        if type == PAWN and end == self.ep:
+            capture_sq = end + (WIDTH if color == WHITE else -WIDTH)
+            captured = board[capture_sq]
+            self._remove(capture_sq)
+        self.history.append((move, captured, capture_sq, self.castling,
+                             self.ep, self.halfmove, key))
+        #Move the piece, promoting it if needed
+        if promotion:
+            piece = make_piece(color, promotion)
+        if board[end]:
+            self._replace(end, piece)
+        else:
+            self._place(end, piece)
+        #Shift the rook when castling
+        if type == KING:
+            self.kings[color] = end
+            if end - start == 2 or end - start == -2:
+                for castle in CASTLES[color]:
+                    if castle[2] == end:
+                        rook = board[castle[3]]
+                        self._remove(castle[3])
+                        self._place(castle[4], rook)
+        #Update the rest of the state
+        self.castling &= CASTLE_MASK[start] & CASTLE_MASK[end]
+        if type == PAWN and (end - start == 2*WIDTH or end - start == -2*WIDTH):
+            self.ep = (start + end) // 2
+        else:
+            self.ep = -1
+        if type == PAWN or captured:
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        if color == BLACK:
+            self.fullmove += 1
+        self.turn = color ^ 1
+        self.key ^= (ZOBRIST_TURN ^ ZOBRIST_CASTLING[self.castling] ^ 
+                     self._ep_key())
+        self.repetitions[self.key] = self.repetitions.get(self.key, 0) + 1
+        if self.debug:
+            self.check_state()
+
+    def unmake_move(self):
+        """Takes back the last move made"""
+        (move, captured, capture_sq, castling, ep, halfmove, 
+         key) = self.history.pop()
+        #Forget this position for repetitions
+        if self.repetitions[self.key] == 1:
+            del self.repetitions[self.key]
+        else:
+            self.repetitions[self.key] -= 1
+        start, end, promotion = move
+        board = self.board
+        color = self.turn ^ 1
+        piece = make_piece(color, PAWN) if promotion else board[end]
+        if piece_type(piece) == KING:
+            self.kings[color] = start
+            if end - start == 2 or end - start == -2:
+                for castle in CASTLES[color]:
+                    if castle[2] == end:
+                        rook = board[castle[4]]
+                        self._remove(castle[4])
+                        self._place(castle[3], rook)
+        if captured and capture_sq == end:
+            self._replace(end, captured)
+        else:
+            self._remove(end)
+            if captured:
+                self._place(capture_sq, captured)
+        self._place(start, piece)
+        self.castling = castling
+        self.ep = ep
+        self.halfmove = halfmove
+        if color == BLACK:
+            self.fullmove -= 1
+        self.turn = color
+        self.key = key
+        if self.debug:
+            self.check_state()
+
+    def is_promotion(self, start, end):
+        """Returns true if moving between the coordinates promotes a pawn"""
+        return (piece_type(self.board[square(*start)]) == PAWN and
+                (end[1] == 0 or end[1] == HEIGHT-1))
+
+class PositionStore:
+    """Positions kept compressed in one bytearray, COMPACT_SIZE bytes each
+    instead of the board, attack counts and history of a Position, so
+    millions of them fit in memory. Positions come back out as Position
+    objects ready to play from."""
+    def __init__(self, positions = ()):
+        """Initiates the store with any positions given"""
+        self.data = bytearray()
+        for position in positions:
+            self.append(position)
+
+    def __len__(self):
+        return len(self.data) // COMPACT_SIZE
+
+    def __getitem__(self, index):
+        """Returns the position stored at an index"""
+        return Position.decompress(self.get_compressed(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, position):
+        """Stores a position"""
+        self.data += position.compress()
+
+    def get_compressed(self, index):
+        """Returns the bytes of the position stored at an index"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('position index out of range')
+        return bytes(self.data[index*COMPACT_SIZE:(index+1)*COMPACT_SIZE])
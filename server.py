@@ -0,0 +1,293 @@
+"""Hosts many games at once over TCP, between people or against the computer
+
+Every game has its own Position, so any number of them can be played from
+one process, unlike the window that keeps its one game on the Side class.
+Clients send one JSON object per line and get one back per request:
+
+    {"op": "new", "fen": "<fen>", "bot": "black"}   fen and bot are optional
+    {"op": "move", "game": 1, "move": "e2e4"}       the bot replies at once
+    {"op": "undo", "game": 1}                       also takes back the bot
+    {"op": "resign", "game": 1}                     the side to move resigns
+    {"op": "state", "game": 1}
+    {"op": "close", "game": 1}                      forgets a finished game
+    {"op": "info"}                                  games hosted and played
+
+Replies carry "ok" and either the state of the game or an "error", and echo
+the "id" of the request if it had one. Moves are worked out on a pool of
+threads and the computer's searches on a pool of processes, so the event
+loop keeps answering other games meanwhile. Start it with:
+
+    python server.py --port 8765
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from bitbase import Bitbases
+from engine import Engine
+from position import (Position, START_FEN, WHITE, COLOR_NAMES, move_name,
+                      parse_move)
+
+HOST = '127.0.0.1'
+PORT = 8765
+#Seconds the computer thinks about a move and the deepest it goes
+BOT_MOVETIME = 0.1
+BOT_DEPTH = 4
+#Longest request line read from a client
+LINE_LIMIT = 1 << 16
+
+#Engine of a search process, made on its first search
+_engine = None
+
+def _bot_move(packed, moves, depth, movetime):
+    """Returns the computer's move in a search process, the moves are
+    played from the packed start position so the search knows the
+    positions that were repeated"""
+    global _engine
+    if _engine is None:
+        _engine = Engine(bitbases = Bitbases())
+    position = Position.unpack(packed)
+    for move in moves:
+        position.make_move(move)
+    return _engine.search(position, depth, movetime)[0]
+
+class Game:
+    """One game: its position, the moves played, who plays as the computer
+    and the result once it is over"""
+    def __init__(self, number, fen = None, bot = None):
+        """Starts the game from the start position or a FEN string, bot is
+        the color the computer plays or None"""
+        self.number = number
+        self.position = Position(fen or START_FEN)
+        self.start = self.position.pack()
+        self.moves = []
+        self.bot = bot
+        self.result = None
+        self.reason = None
+        #Requests of one game are played one at a time
+        self.lock = asyncio.Lock()
+        self.update_result()
+
+    def is_over(self):
+        """Returns true once the game has a result"""
+        return self.result is not None
+
+    def bot_to_move(self):
+        """Returns true if the computer has the next move"""
+        return not self.is_over() and self.bot == self.position.turn
+
+    def update_result(self):
+        """Ends the game on checkmate, stalemate or threefold repetition"""
+        position = self.position
+        if not position.generate_legal_moves():
+            if position.is_check():
+                self.result = '0-1' if position.turn == WHITE else '1-0'
+                self.reason = 'checkmate'
+            else:
+                self.result = '1/2-1/2'
+                self.reason = 'stalemate'
+        elif position.is_repetition():
+            self.result = '1/2-1/2'
+            self.reason = 'repetition'
+
+    def play(self, move):
+        """Plays a person's legal move, raises ValueError for any other move,
+        when the computer is to move or when the game is over"""
+        if self.bot_to_move():
+            raise ValueError('the computer is to move')
+        self.play_computer(move)
+
+    def play_computer(self, move):
+        """Plays a legal move, raises ValueError for any other move or when
+        the game is over"""
+        if self.is_over():
+            raise ValueError(f'game {self.number} is over')
+        if not self.position.is_legal(move):
+            raise ValueError(f'illegal move {move_name(move)}')
+        self.position.make_move(move)
+        self.moves.append(move)
+        self.update_result()
+
+    def undo(self):
+        """Takes back the last move, and the computer's reply before it so
+        the person is to move again, the computer's first move is left for
+        it to play again"""
+        if not self.moves:
+            raise ValueError('no move to undo')
+        self.result = self.reason = None
+        self.position.unmake_move()
+        self.moves.pop()
+        if self.bot == self.position.turn and self.moves:
+            self.position.unmake_move()
+            self.moves.pop()
+
+    def resign(self):
+        """Ends the game with a win for the side not to move"""
+        if self.is_over():
+            raise ValueError(f'game {self.number} is over')
+        self.result = '0-1' if self.position.turn == WHITE else '1-0'
+        self.reason = 'resignation'
+
+    def state(self):
+        """Returns the game as a dict for the reply"""
+        position = self.position
+        legal = [] if self.is_over() else position.generate_legal_moves()
+        return {'game': self.number, 'fen': position.fen(),
+                'turn': COLOR_NAMES[position.turn],
+                'moves': [move_name(move) for move in self.moves],
+                'legal': [move_name(move) for move in legal],
+                'check': position.is_check(),
+                'bot': None if self.bot is None else COLOR_NAMES[self.bot],
+                'result': self.result, 'reason': self.reason}
+
+class Server:
+    """Keeps the games and answers the requests of every connection"""
+    def __init__(self, threads = 4, workers = 1, depth = BOT_DEPTH,
+                 movetime = BOT_MOVETIME):
+        """Initiates the server without games, moves are worked out on the
+        threads and searches on the worker processes"""
+        self.games = {}
+        self.next_game = 1
+        self.played = 0
+        self.rules = ThreadPoolExecutor(threads)
+        self.search = ProcessPoolExecutor(workers)
+        self.depth = depth
+        self.movetime = movetime
+
+    def close(self):
+        """Stops the thread and process pools"""
+        self.rules.shutdown()
+        self.search.shutdown()
+
+    async def run_rules(self, function, *args):
+        """Returns the result of a rules function run on the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.rules, function, *args)
+
+    async def play_bot(self, game):
+        """Plays the computer's move if it is to move"""
+        if game.bot_to_move():
+            loop = asyncio.get_running_loop()
+            move = await loop.run_in_executor(
+                self.search, _bot_move, game.start, game.moves[:],
+                self.depth, self.movetime)
+            await self.run_rules(game.play_computer, move)
+
+    def get_text(self, request, field):
+        """Returns a field of a request that must be a string, None if it is
+        left out"""
+        value = request.get(field)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{field} must be a string, not {value!r}')
+        return value
+
+    def get_game(self, request):
+        """Returns the game a request names"""
+        game = self.games.get(request.get('game'))
+        if game is None:
+            raise ValueError(f'no game {request.get("game")!r}')
+        return game
+
+    async def handle_request(self, request):
+        """Returns the reply to a request"""
+        op = request.get('op')
+        if op == 'info':
+            return {'games': len(self.games), 'played': self.played}
+        if op == 'new':
+            bot = request.get('bot')
+            if bot is not None and bot not in COLOR_NAMES:
+                raise ValueError(f'bot must be white or black, not {bot!r}')
+            number = self.next_game
+            self.next_game += 1
+            game = await self.run_rules(
+                Game, number, self.get_text(request, 'fen'),
+                None if bot is None else COLOR_NAMES.index(bot))
+            self.games[number] = game
+            self.played += 1
+            async with game.lock:
+                await self.play_bot(game)
+                return await self.run_rules(game.state)
+        game = self.get_game(request)
+        if op == 'close':
+            del self.games[game.number]
+            return {'game': game.number}
+        async with game.lock:
+            if op == 'move':
+                move = self.get_text(request, 'move')
+                if move is None:
+                    raise ValueError('move is missing')
+                await self.run_rules(game.play, parse_move(move))
+                await self.play_bot(game)
+            elif op == 'undo':
+                await self.run_rules(game.undo)
+                await self.play_bot(game)
+            elif op == 'resign':
+                game.resign()
+            elif op != 'state':
+                raise ValueError(f'unknown op {op!r}')
+            return await self.run_rules(game.state)
+
+    async def handle_connection(self, reader, writer):
+        """Answers the requests of a connection until it closes"""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    #The line was longer than the limit
+                    break
+                if not line:
+                    break
+                reply = {'ok': True}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('requests must be JSON objects')
+                    if 'id' in request:
+                        reply['id'] = request['id']
+                    reply.update(await self.handle_request(request))
+                except (ValueError, TypeError) as error:
+                    reply['ok'] = False
+                    reply['error'] = str(error)
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host = HOST, port = PORT):
+        """Serves connections until cancelled"""
+        server = await asyncio.start_server(self.handle_connection, host,
+                                            port, limit = LINE_LIMIT)
+        print(f'serving games on {host}:{port}', flush = True)
+        async with server:
+            await server.serve_forever()
+
+def main(argv = None):
+    """Runs the server from the command line"""
+    parser = argparse.ArgumentParser(description = 'Serve games over TCP')
+    parser.add_argument('--host', default = HOST)
+    parser.add_argument('--port', type = int, default = PORT)
+    parser.add_argument('--threads', type = int, default = 4,
+                        help = 'threads to work out the moves on')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(),
+                        help = 'processes the computer searches in')
+    parser.add_argument('--bot-depth', type = int, default = BOT_DEPTH)
+    parser.add_argument('--bot-movetime', type = float, default = BOT_MOVETIME,
+                        help = 'seconds the computer thinks about a move')
+    args = parser.parse_args(argv)
+    server = Server(args.threads, args.workers, args.bot_depth,
+                    args.bot_movetime)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Plays whole games without a window to stress the rules and time them
+
+Every game is played from the start position (or --fen) by two movers that
+pick from the legal moves of the Position, the same rules the game window
+uses. A game ends the way it ends in the window, by checkmate, stalemate or
+threefold repetition, and random games are also stopped by the fifty move
+rule or after --max-plies. Games are spread over a pool of processes.
+
+    python simulate.py 1000
+    python simulate.py 200 --policy greedy --workers 4 --debug
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from position import (Position, START_FEN, WHITE, EMPTY, PAWN, KING, VALUES,
+                      piece_type)
+
+#Ways a game can end
+RESULTS = ('white mates', 'black mates', 'stalemate', 'repetition',
+           'fifty moves', 'move limit')
+#Special moves counted over all games
+EVENTS = ('captures', 'castles', 'en passant', 'promotions')
+#Width of the game length histogram buckets in plies
+BUCKET = 20
+
+def random_mover(position, moves, rng):
+    """Returns any legal move"""
+    return rng.choice(moves)
+
+def greedy_mover(position, moves, rng):
+    """Returns the move taking the most valuable piece, promoting first,
+    and any move when nothing can be taken"""
+    best = []
+    best_value = 0
+    for move in moves:
+        value = VALUES[piece_type(position.board[move[1]])] + VALUES[move[2]]
+        if value > best_value:
+            best, best_value = [move], value
+        elif value == best_value and best_value:
+            best.append(move)
+    return rng.choice(best or moves)
+
+POLICIES = {'random': random_mover, 'greedy': greedy_mover}
+
+def count_events(position, move, events):
+    """Counts the special moves among the captures, castles, en passant
+    captures and promotions"""
+    start, end, promotion = move
+    type = piece_type(position.board[start])
+    if position.board[end] != EMPTY:
+        events['captures'] += 1
+    elif type == PAWN and (start - end) % 8:
+        events['captures'] += 1
+        events['en passant'] += 1
+    if type == KING and abs(end - start) == 2:
+        events['castles'] += 1
+    if promotion != EMPTY:
+        events['promotions'] += 1
+
+def play_game(seed, fen = START_FEN, policy = 'random', max_plies = 500):
+    """Plays one game and returns its result, length in plies and events"""
+    rng = random.Random(seed)
+    mover = POLICIES[policy]
+    position = Position(fen)
+    events = dict.fromkeys(EVENTS, 0)
+    plies = 0
+    while True:
+        moves = position.generate_legal_moves()
+        if not moves:
+            if not position.is_check():
+                result = 'stalemate'
+            elif position.turn == WHITE:
+                result = 'black mates'
+            else:
+                result = 'white mates'
+            break
+        if position.is_repetition():
+            result = 'repetition'
+            break
+        if position.halfmove >= 100:
+            result = 'fifty moves'
+            break
+        if plies >= max_plies:
+            result = 'move limit'
+            break
+        move = mover(position, moves, rng)
+        count_events(position, move, events)
+        position.make_move(move)
+        plies += 1
+    return result, plies, events
+
+def _play_games(args):
+    """Plays a batch of games in a worker process"""
+    seeds, fen, policy, max_plies, debug = args
+    Position.debug = debug
+    return [play_game(seed, fen, policy, max_plies) for seed in seeds]
+
+def simulate(games, fen = START_FEN, policy = 'random', max_plies = 500,
+             workers = 1, seed = 0, debug = False):
+    """Plays games over workers processes and returns the list of their
+    results, lengths and events"""
+    seeds = range(seed, seed + games)
+    if workers <= 1:
+        return _play_games((seeds, fen, policy, max_plies, debug))
+    #A few batches per worker keeps them busy while the games vary in length
+    size = max(1, games // (workers * 4))
+    batches = [(seeds[i:i+size], fen, policy, max_plies, debug)
+               for i in range(0, games, size)]
+    with ProcessPoolExecutor(workers) as pool:
+        return [game for batch in pool.map(_play_games, batches)
+                for game in batch]
+
+def report(played, seconds):
+    """Prints the throughput, results, events and length histogram"""
+    plies = sum(game[1] for game in played)
+    games = len(played)
+    seconds = max(seconds, 1e-9)
+    print(f'{games} games, {plies} plies in {seconds:.2f}s: '
+          f'{games / seconds:.1f} games/s, {plies / seconds:.0f} plies/s')
+    print('results:')
+    for result in RESULTS:
+        count = sum(1 for game in played if game[0] == result)
+        print(f'  {result:<12} {count:>7} {100 * count / max(games, 1):6.1f}%')
+    print('events:')
+    for event in EVENTS:
+        print(f'  {event:<12} {sum(game[2][event] for game in played):>7}')
+    print('game length in plies:')
+    buckets = {}
+    for game in played:
+        buckets[game[1] // BUCKET] = buckets.get(game[1] // BUCKET, 0) + 1
+    largest = max(buckets.values(), default = 1)
+    for bucket in sorted(buckets):
+        low = bucket * BUCKET
+        bar = '#' * max(1, 40 * buckets[bucket] // largest)
+        print(f'  {low:>4}-{low + BUCKET - 1:<4} {buckets[bucket]:>7} {bar}')
+
+def main(argv = None):
+    """Plays games from the command line"""
+    parser = argparse.ArgumentParser(description = 'Play games headlessly')
+    parser.add_argument('games', type = int, nargs = '?', default = 100)
+    parser.add_argument('--fen', default = START_FEN)
+    parser.add_argument('--policy', choices = sorted(POLICIES),
+                        default = 'random')
+    parser.add_argument('--max-plies', type = int, default = 500)
+    parser.add_argument('--workers', type = int, default = os.cpu_count(),
+                        help = 'processes to play the games in, 1 plays them '
+                               'in this process')
+    parser.add_argument('--seed', type = int, default = 0,
+                        help = 'seed of the first game, games are repeatable')
+    parser.add_argument('--debug', action = 'store_true',
+                        help = 'check the incremental state after every move')
+    args = parser.parse_args(argv)
+    #Fail on a bad position before starting the workers
+    Position(args.fen)
+    start = time.perf_counter()
+    played = simulate(args.games, args.fen, args.policy, args.max_plies,
+                      args.workers, args.seed, args.debug)
+    report(played, time.perf_counter() - start)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
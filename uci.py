@@ -0,0 +1,187 @@
+"""Universal Chess Interface for the engine, so tournament managers and
+analysis programs can drive it over stdin and stdout
+
+The main thread only reads commands while searches run on their own thread,
+so stop, isready and quit are answered right away, even in the middle of a
+search. Run it from any UCI program with:
+
+    python uci.py
+"""
+import sys
+import threading
+from bitbase import Bitbases
+from engine import Engine, MATE, MAX_DEPTH, MATE_SCORES
+from position import Position, START_FEN, WHITE, move_name, parse_move
+
+NAME = 'Pygame Chess'
+AUTHOR = 'Brian Morse'
+#Share of the clock spent on a move when the moves left are not given
+MOVES_LEFT = 30
+#Seconds kept back on the clock for the time lost talking to the program
+OVERHEAD = 0.05
+
+class UCI:
+    """Keeps the position and runs searches for the commands it is given"""
+    def __init__(self, output = sys.stdout):
+        """Starts at the start position with an idle engine"""
+        self.output = output
+        self.lock = threading.Lock()
+        self.engine = Engine(bitbases = Bitbases())
+        self.position = Position()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.infinite = False
+
+    def send(self, line):
+        """Writes a line to the program driving the engine"""
+        with self.lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def handle(self, line):
+        """Runs one command, returns False once the engine has to quit"""
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == 'uci':
+            self.send(f'id name {NAME}')
+            self.send(f'id author {AUTHOR}')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'ucinewgame':
+            self.stop()
+            self.engine.clear()
+            self.position = Position()
+        elif command == 'position':
+            self.stop()
+            self.set_position(args)
+        elif command == 'go':
+            self.stop()
+            self.go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'd':
+            self.send(f'info string {self.position.fen()}')
+        elif command == 'quit':
+            self.stop()
+            return False
+        else:
+            self.send(f'info string unknown command {command}')
+        return True
+
+    def set_position(self, args):
+        """Sets up the position from startpos or a FEN and the moves after
+        it"""
+        if 'moves' in args:
+            moves = args[args.index('moves')+1:]
+            args = args[:args.index('moves')]
+        else:
+            moves = []
+        try:
+            if args and args[0] == 'fen':
+                position = Position(' '.join(args[1:]))
+            else:
+                position = Position(START_FEN)
+            for name in moves:
+                move = parse_move(name)
+                if not position.is_legal(move):
+                    raise ValueError(f'illegal move {name!r}')
+                position.make_move(move)
+        except ValueError as error:
+            self.send(f'info string {error}')
+            return
+        self.position = position
+
+    def go(self, args):
+        """Starts a search with the limits of a go command"""
+        options = {}
+        for name, value in zip(args, args[1:] + ['']):
+            if value.lstrip('-').isdigit():
+                options[name] = int(value)
+        depth = options.get('depth', MAX_DEPTH)
+        movetime = None
+        if 'movetime' in options:
+            movetime = options['movetime'] / 1000
+        elif 'wtime' in options or 'btime' in options:
+            movetime = self.budget(options)
+        self.infinite = 'infinite' in args
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target = self._search, args = (self.position.copy(), depth,
+                                           movetime), daemon = True)
+        self.thread.start()
+
+    def budget(self, options):
+        """Returns the seconds to spend on a move from the clocks"""
+        if self.position.turn == WHITE:
+            left, increment = options.get('wtime', 0), options.get('winc', 0)
+        else:
+            left, increment = options.get('btime', 0), options.get('binc', 0)
+        left /= 1000
+        increment /= 1000
+        share = left / options.get('movestogo', MOVES_LEFT) + increment / 2
+        return max(min(share, left / 2 - OVERHEAD), 0.01)
+
+    def stop(self):
+        """Stops the running search, which still reports its best move"""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def _search(self, position, depth, movetime):
+        """Searches on the search thread and reports the best move"""
+        def info(depth, score, nodes, seconds, move):
+            nps = int(nodes / seconds) if seconds > 0 else 0
+            pv = ' '.join(move_name(move) for move in
+                          self.principal_variation(position, depth))
+            self.send(f'info depth {depth} score {format_score(score)} '
+                      f'nodes {nodes} nps {nps} time {int(seconds * 1000)} '
+                      f'pv {pv or move_name(move)}')
+        move, score = self.engine.search(position, depth, movetime,
+                                         self.stop_event, info)
+        #Infinite searches only answer once they are stopped
+        if self.infinite:
+            self.stop_event.wait()
+        if move is None:
+            self.send('bestmove 0000')
+        else:
+            self.send(f'bestmove {move_name(move)}')
+
+    def principal_variation(self, position, depth):
+        """Returns the best line the transposition table holds"""
+        position = position.copy()
+        line = []
+        while len(line) < depth:
+            entry = self.engine.table.get(position.key)
+            if not entry or not entry[3] or not position.is_legal(entry[3]):
+                break
+            line.append(entry[3])
+            position.make_move(entry[3])
+            #Stop on a repeated position so the line cannot loop
+            if position.repetitions[position.key] > 1:
+                break
+        return line
+
+def format_score(score):
+    """Returns a score in centipawns or moves to mate as UCI writes it"""
+    if score > MATE_SCORES:
+        return f'mate {(MATE - score + 1) // 2}'
+    if score < -MATE_SCORES:
+        return f'mate -{(MATE + score) // 2}'
+    return f'cp {score}'
+
+def main():
+    """Reads commands from stdin until quit or the end of input"""
+    uci = UCI()
+    for line in sys.stdin:
+        if not uci.handle(line):
+            break
+    else:
+        uci.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())